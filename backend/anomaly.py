@@ -0,0 +1,133 @@
+import numpy as np
+from dataset import LogDataset, to_python
+
+DEFAULT_WINDOW = 200
+MIN_PERIODS = 10
+MAD_SCALE = 0.6745  # makes the MAD score comparable to a z-score for normal data
+
+
+def rolling_zscore(values, window=DEFAULT_WINDOW):
+    """
+    Score each sample against the mean and std of the ``window`` samples before it.
+
+    Uses cumulative sums, so the whole column is scored in O(n) regardless of
+    the window length. Samples with fewer than ``MIN_PERIODS`` predecessors,
+    or a flat window, score 0.
+    """
+    centered = values - values.mean()
+    sums = np.concatenate([[0.0], np.cumsum(centered)])
+    squares = np.concatenate([[0.0], np.cumsum(centered ** 2)])
+
+    ends = np.arange(len(values))
+    starts = np.maximum(0, ends - window)
+    counts = ends - starts
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = (sums[ends] - sums[starts]) / counts
+        std = np.sqrt(np.maximum((squares[ends] - squares[starts]) / counts - mean ** 2, 0.0))
+        scores = (centered - mean) / std
+    scores[(counts < MIN_PERIODS) | ~(std > 0)] = 0.0
+    return scores
+
+
+def rolling_mad(values, window=DEFAULT_WINDOW):
+    """
+    Robust score from the median and MAD of consecutive ``window``-sample blocks.
+
+    Each sample is scored against the block it falls in. Medians are taken per
+    block rather than per sample, which keeps the cost O(n) while staying
+    insensitive to the spikes being detected.
+    """
+    n = len(values)
+    window = max(1, min(window, n))
+    blocks = -(-n // window)
+    padded = np.full(blocks * window, np.nan)
+    padded[:n] = values
+    padded = padded.reshape(blocks, window)
+
+    median = np.nanmedian(padded, axis=1)
+    mad = np.nanmedian(np.abs(padded - median[:, None]), axis=1)
+
+    block = np.arange(n) // window
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = MAD_SCALE * (values - median[block]) / mad[block]
+    scores[~(mad[block] > 0)] = 0.0
+    return scores
+
+
+SCORERS = {"zscore": rolling_zscore, "mad": rolling_mad}
+
+
+def anomaly_segments(times, values, threshold=3.0, window=DEFAULT_WINDOW, method="zscore", merge_gap=5):
+    """
+    Merge samples whose rolling score exceeds ``threshold`` into segments.
+
+    Args:
+        times (np.ndarray): Sample times in ascending order
+        values (np.ndarray): Float values aligned with ``times``, without NaN
+        threshold (float): Absolute score above which a sample is anomalous
+        window (int): Rolling window length in samples
+        method (str): "zscore" (rolling mean/std) or "mad" (blockwise median/MAD)
+        merge_gap (int): Flagged samples at most this many samples apart share a segment
+
+    Returns:
+        tuple: (list of segment dicts, number of flagged samples)
+    """
+    if method not in SCORERS:
+        raise ValueError(f"Unknown anomaly method '{method}', expected one of {sorted(SCORERS)}")
+    if len(values) == 0:
+        return [], 0
+
+    scores = SCORERS[method](values, window)
+    flagged = np.flatnonzero(np.abs(scores) > threshold)
+    if not len(flagged):
+        return [], 0
+
+    breaks = np.flatnonzero(np.diff(flagged) > merge_gap)
+    first = flagged[np.concatenate([[0], breaks + 1])]
+    last = flagged[np.concatenate([breaks, [len(flagged) - 1]])]
+
+    segments = []
+    for start, end in zip(first, last):
+        peak = start + int(np.argmax(np.abs(scores[start:end + 1])))
+        segments.append({
+            "start_time": to_python(times[start]),
+            "end_time": to_python(times[end]),
+            "samples": int(end - start + 1),
+            "peak_time": to_python(times[peak]),
+            "peak_value": to_python(values[peak]),
+            "peak_score": round(float(scores[peak]), 2)
+        })
+    return segments, len(flagged)
+
+
+def detect_anomalies(dataset: LogDataset, field, message_types, threshold=3.0, window=DEFAULT_WINDOW,
+                     method="zscore", max_segments=20):
+    """
+    Rolling-window anomaly segments for a numeric field across messages.
+
+    Each message is scored on its own time-ordered samples. Only the
+    ``max_segments`` strongest segments are returned (in time order), so the
+    output stays bounded on multi-hour logs; the counts cover all of them.
+    """
+    segments = []
+    flagged = 0
+    for msg in message_types:
+        series = dataset.time_series(msg, field)
+        if series is None:
+            continue
+
+        times, values = series
+        present = ~np.isnan(values)
+        msg_segments, msg_flagged = anomaly_segments(
+            times[present], values[present], threshold, window, method
+        )
+        segments.extend(dict(segment, message_type=msg) for segment in msg_segments)
+        flagged += msg_flagged
+
+    strongest = sorted(segments, key=lambda s: abs(s["peak_score"]), reverse=True)[:max_segments]
+    return {
+        "segments_found": len(segments),
+        "flagged_samples": flagged,
+        "segments": sorted(strongest, key=lambda s: s["start_time"])
+    }
@@ -1,15 +1,27 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import os, json, datetime, re
+import os, json, datetime, re, tempfile
 from stage1 import classify
 from stage2 import run_stage_2
 from stage3 import run_stage_3
+from ingest import InvalidChunk, dataset_from_binary, dataset_from_frontend, ingest_ndjson_stream
+from logreader import read_log
+from cache import DatasetCache, hash_bytes, hash_file, new_hasher
+from store import DatasetStore
+from evidence import is_row_ref, row_ref
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Global variable to store parser data
-parser_data = None
+# On-disk cache of converted datasets, keyed by the content hash of the upload
+dataset_cache = DatasetCache()
+
+# Uploaded datasets (columnar LogDatasets) keyed by dataset ID, bounded by a
+# memory budget. After a restart the most recently used cached dataset is
+# reattached so clients that do not send a dataset_id keep working.
+dataset_store = DatasetStore(cache=dataset_cache)
+if (recent := dataset_cache.most_recent()) is not None:
+    dataset_store.put(*recent)
 
 def log_stage_output(stage_name, input_data, output_data, error=None, timestamp=None):
     """
@@ -49,115 +61,194 @@ def log_stage_output(stage_name, input_data, output_data, error=None, timestamp=
         print(f"Error writing to log file {log_filename}: {str(e)}")
 
 
-def normalize_message_type(key):
-    return re.sub(r'\[\d+\]$', '', key).lower()
-
-def make_json_safe(obj):
-    import numpy as np
-    if isinstance(obj, bytes):
-        return obj.decode(errors="ignore")
-    elif isinstance(obj, (list, tuple)):
-        return [make_json_safe(i) for i in obj]
-    elif isinstance(obj, dict):
-        return {k.lower(): make_json_safe(v) for k, v in obj.items()}
-    elif hasattr(obj, 'tolist'):
-        return obj.tolist()
-    elif isinstance(obj, (np.integer, np.floating)):
-        return obj.item()
-    return obj
-
-def convert_frontend_to_backend_format(frontend_data):
-    backend_data = {}
-
-    if 'messages' not in frontend_data:
-        return frontend_data
-
-    for original_key, message_data in frontend_data['messages'].items():
-        msg_type = normalize_message_type(original_key)
-
-        if isinstance(message_data, dict):
-            field_names = list(message_data.keys())
-
-            # Check if it's field-array format: each field is a list
-            if field_names and any(isinstance(message_data[f], list) for f in field_names):
-                length = max((len(message_data[f]) for f in field_names if isinstance(message_data[f], list)), default=0)
-                message_array = []
-
-                for i in range(length):
-                    entry = {}
-                    for field in field_names:
-                        if i < len(message_data[field]):
-                            field_name = field.lower()
-                            value = make_json_safe(message_data[field][i])
-                            if field_name == "time_boot_ms":
-                                field_name = "timeus"
-                                value = value * 1000  # Convert milliseconds to microseconds
-                            entry[field_name] = value
-                    message_array.append(entry)
-
-                backend_data[msg_type] = message_array
-
-            else:
-                # Treat as single-row dict of scalar values
-                entry = {}
-                for field in field_names:
-                    field_name = field.lower()
-                    value = message_data[field]
-                    if field_name == "time_boot_ms":
-                        field_name = "timeus"
-                        value = value * 1000  # Convert milliseconds to microseconds
-                    entry[field_name] = make_json_safe(value)
-                backend_data[msg_type] = [entry]
-
-        elif isinstance(message_data, list):
-            # Likely already list of dicts
-            message_array = []
-            for row in message_data:
-                if isinstance(row, dict):
-                    entry = {}
-                    for k, v in row.items():
-                        field_name = k.lower()
-                        value = make_json_safe(v)
-                        if field_name == "time_boot_ms":
-                            field_name = "timeus"
-                            value = value * 1000  # Convert milliseconds to microseconds
-                        entry[field_name] = value
-                    message_array.append(entry)
-            backend_data[msg_type] = message_array
-
-        else:
-            print(f"[Warning] Unexpected format for message '{msg_type}': {type(message_data)} — skipped.")
-            backend_data[msg_type] = []
-
-    return backend_data
+def print_upload_progress(chunks, bytes_read, total_bytes, every=100):
+    if chunks % every:
+        return
+    if total_bytes:
+        print(f"Parser upload: {chunks} chunks, {bytes_read}/{total_bytes} bytes ({100 * bytes_read / total_bytes:.0f}%)")
+    else:
+        print(f"Parser upload: {chunks} chunks, {bytes_read} bytes")
+
+
+def resolve_dataset(dataset_id=None):
+    """Return ``(dataset_id, dataset)`` for a request; without an ID, use the latest upload."""
+    dataset_id = dataset_id or dataset_store.latest_id
+    if dataset_id is None:
+        return None, None
+    return dataset_id, dataset_store.get(dataset_id)
+
+
+def dataset_error(dataset_id):
+    """Error body and status for a request whose dataset could not be resolved."""
+    if dataset_id is None:
+        return {'error': 'Parser data not set. Please upload parser data first.'}, 400
+    return {'error': f"Dataset '{dataset_id}' not found. Please upload the log again."}, 404
+
+
+def dataset_not_found(dataset_id):
+    body, status = dataset_error(dataset_id)
+    return jsonify(body), status
+
+
+def stage2_extra_context(stage2_response):
+    """The parts of a Stage 2 response passed to Stage 3 as extra context."""
+    return {
+        k: stage2_response[k]
+        for k in ['query_time_us', 'unavailable_sources', 'summary', 'note', 'warning', 'error']
+        if k in stage2_response
+    }
+
+
+def stage2_context(stage2):
+    """
+    The Stage 2 result as carried in ``stage3Context``: its evidence reduced to
+    row references. The evidence itself is already in the Stage 3 messages.
+    """
+    if not stage2:
+        return None
+    evidence = stage2.get("evidence")
+    refs = [row_ref(item["message_type"], item["row_index"])
+            for item in (evidence if isinstance(evidence, list) else []) if is_row_ref(item)]
+    return {
+        "intent": stage2.get("intent"),
+        "field": stage2.get("field"),
+        "candidate_messages": stage2.get("candidate_messages"),
+        "evidence": refs or None
+    }
+
+
+def stage3_reply(stage3_response, dataset_id, stage2, extra_context):
+    """Chat reply for a Stage 3 result, with the context needed to continue after a clarification."""
+    if stage3_response.get("status") == "clarification_requested":
+        return {
+            "message": stage3_response["question"],
+            "expecting_clarification": True,
+            "stage3Context": {
+                "dataset_id": dataset_id,
+                "messages": stage3_response["messages"],  # captured inside run_stage_3
+                "stage2": stage2_context(stage2),
+                "extra_context": extra_context
+            }
+        }
+
+    elif stage3_response.get("status") == "answered":
+        return {
+            "message": stage3_response["answer"],
+            "expecting_clarification": False
+        }
+
+    return {
+        "message": stage3_response.get("message", "Could not complete reasoning."),
+        "expecting_clarification": False
+    }
+
+
+def load_or_convert(key, convert):
+    """Reattach the cached dataset for ``key`` or run ``convert()`` and cache its result."""
+    dataset = dataset_cache.get(key)
+    if dataset is not None:
+        print(f"Reattached cached dataset {key}.")
+        return dataset, True
+    dataset = convert()
+    dataset_cache.put(key, dataset)
+    return dataset, False
 
 
 @app.route('/api/parser', methods=['POST'])
 def receive_parser():
-    global parser_data
     try:
-        data = request.get_json()
-        if not data:
+        # Streaming mode: one NDJSON message chunk per line, converted as it arrives
+        if request.mimetype == 'application/x-ndjson':
+            hasher = new_hasher()
+
+            def hashed_lines(stream):
+                for line in stream:
+                    hasher.update(line)
+                    yield line
+
+            try:
+                dataset, stats = ingest_ndjson_stream(
+                    hashed_lines(request.stream),
+                    total_bytes=request.content_length,
+                    progress=print_upload_progress
+                )
+            except InvalidChunk as e:
+                print("Rejected /api/parser upload:", str(e))
+                return jsonify({'error': str(e), 'line': e.line_number}), 400
+            dataset_id = hasher.hexdigest()
+            dataset_cache.put(dataset_id, dataset)
+            dataset_store.put(dataset_id, dataset)
+            print(f"Parser data streamed: {stats['chunks']} chunks, {sum(stats['row_counts'].values())} rows.")
+            return jsonify({'status': 'success', 'dataset_id': dataset_id, **stats})
+
+        # Raw log mode: a .bin/.tlog file uploaded as multipart form data and parsed here
+        if 'file' in request.files:
+            upload = request.files['file']
+            suffix = os.path.splitext(upload.filename or '')[1].lower() or '.bin'
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+                upload.save(tmp)
+            try:
+                dataset_id = hash_file(tmp.name)
+                dataset, cached = load_or_convert(dataset_id, lambda: read_log(tmp.name)[0])
+            finally:
+                os.remove(tmp.name)
+            dataset_store.put(dataset_id, dataset)
+            print(f"Loaded {upload.filename} ({len(dataset)} message types).")
+            return jsonify({
+                'status': 'success',
+                'dataset_id': dataset_id,
+                'cached': cached,
+                'row_counts': {msg: dataset.num_rows(msg) for msg in dataset.keys()}
+            })
+
+        body = request.get_data()
+        if not body:
             return jsonify({'error': 'No parser data received'}), 400
-        
-        # Convert frontend format to backend format
-        parser_data = convert_frontend_to_backend_format(data)
-        
+        dataset_id = hash_bytes(body)
+
+        # Binary mode: JSON header followed by raw little-endian typed-array buffers
+        if request.mimetype == 'application/octet-stream':
+            dataset, cached = load_or_convert(dataset_id, lambda: dataset_from_binary(body))
+            dataset_store.put(dataset_id, dataset)
+            print("Parser data received in binary format.")
+            return jsonify({'status': 'success', 'dataset_id': dataset_id, 'cached': cached})
+
+        def convert_json():
+            data = json.loads(body)
+            if not data:
+                raise ValueError('No parser data received')
+            # Convert frontend field arrays straight into backend columns
+            return dataset_from_frontend(data)
+
+        dataset, cached = load_or_convert(dataset_id, convert_json)
+        dataset_store.put(dataset_id, dataset)
+
         print("Parser data received and converted to backend format.")
-        return jsonify({'status': 'success'})
+        return jsonify({'status': 'success', 'dataset_id': dataset_id, 'cached': cached})
     except Exception as e:
         print("Error in /api/parser:", str(e))
         return jsonify({'error': str(e)}), 500
 
+
+@app.route('/api/parser/<dataset_id>', methods=['POST'])
+def reattach_parser(dataset_id):
+    """Reattach a previously uploaded dataset from the cache without re-sending the log."""
+    dataset = dataset_store.get(dataset_id) if re.fullmatch(r'[0-9a-f]{64}', dataset_id) else None
+    if dataset is None:
+        return jsonify({'error': f"Dataset '{dataset_id}' is not cached. Please upload the log again."}), 404
+    dataset_store.put(dataset_id, dataset)
+    return jsonify({'status': 'success', 'dataset_id': dataset_id, 'cached': True})
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    global parser_data
-    if parser_data is None:
-        return jsonify({'error': 'Parser data not set. Please upload parser data first.'}), 400
     try:
         data = request.get_json()
         if not data:
             return jsonify({'error': 'No JSON data received'}), 400
+
+        dataset_id, parser_data = resolve_dataset(data.get('dataset_id'))
+        if parser_data is None:
+            return dataset_not_found(dataset_id)
             
         messages = data.get('messages', [])
         if not messages:
@@ -190,11 +281,8 @@ def chat():
             print(error_msg)
             return jsonify({'error': error_msg}), 500
 
-        extra_context = {}
-        for k in ['query_time_us', 'unavailable_sources', 'summary', 'note', 'warning', 'error']:
-            if k in stage2_response:
-                extra_context[k] = stage2_response[k]
-        
+        extra_context = stage2_extra_context(stage2_response)
+
         # Stage 3: Final Processing
         try:
             stage3_response = run_stage_3(
@@ -222,28 +310,7 @@ def chat():
             print(error_msg)
             return jsonify({'error': error_msg}), 500
 
-        if stage3_response.get("status") == "clarification_requested":
-            return jsonify({
-                "message": stage3_response["question"],
-                "expecting_clarification": True,
-                "stage3Context": {
-                    "messages": stage3_response["messages"],  # captured inside run_stage_3
-                    # "stage1": stage1_data,
-                    "stage2": stage2_response,
-                    "extra_context": extra_context
-                }
-            })
-
-        elif stage3_response.get("status") == "answered":
-            return jsonify({
-                "message": stage3_response["answer"],
-                "expecting_clarification": False
-            })
-
-        return jsonify({
-            "message": stage3_response.get("message", "Could not complete reasoning."),
-            "expecting_clarification": False
-        })
+        return jsonify(stage3_reply(stage3_response, dataset_id, stage2_response, extra_context))
 
     except Exception as e:
         print("Error in /api/chat:", str(e))
@@ -252,9 +319,6 @@ def chat():
 
 @app.route('/api/chat/clarify', methods=['POST'])
 def clarify():
-    global parser_data
-    if parser_data is None:
-        return jsonify({'error': 'Parser data not set. Please upload parser data first.'}), 400
     try:
         print("Clarify route called!")
         data = request.get_json()
@@ -264,6 +328,10 @@ def clarify():
         if not clarification or not context:
             return jsonify({'error': 'Missing clarification or context'}), 400
 
+        dataset_id, parser_data = resolve_dataset(data.get('dataset_id') or context.get('dataset_id'))
+        if parser_data is None:
+            return dataset_not_found(dataset_id)
+
         messages = context.get("messages", [])
         messages.append({"role": "user", "content": clarification})
 
@@ -295,28 +363,7 @@ def clarify():
             print(error_msg)
             return jsonify({'error': error_msg}), 500
 
-        if stage3_response.get("status") == "clarification_requested":
-            return jsonify({
-                "message": stage3_response["question"],
-                "expecting_clarification": True,
-                "stage3Context": {
-                    "messages": stage3_response["messages"],
-                    # "stage1": context.get("stage1"),
-                    "stage2": context.get("stage2"),
-                    "extra_context": context.get("extra_context")
-                }
-            })
-
-        elif stage3_response.get("status") == "answered":
-            return jsonify({
-                "message": stage3_response["answer"],
-                "expecting_clarification": False
-            })
-
-        return jsonify({
-            "message": stage3_response.get("message", "Could not complete reasoning."),
-            "expecting_clarification": False
-        })
+        return jsonify(stage3_reply(stage3_response, dataset_id, context.get("stage2"), context.get("extra_context")))
 
     except Exception as e:
         print("Error in /api/chat/clarify:", str(e))
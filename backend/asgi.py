@@ -0,0 +1,166 @@
+"""
+asyncio serving path for the backend.
+
+The chat endpoints run on the event loop: Stage 1 and every Stage 3 model
+round are awaited on the async OpenAI client, while Stage 2 and the Stage 3
+tool calls run on a bounded thread pool. A chat waiting on the model holds
+no thread, so one process can keep hundreds of chats in flight. Every other
+route (uploads, reattach) is served by the Flask app in ``app.py``.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.wsgi import WsgiToAsgi
+from app import app as flask_app, dataset_error, resolve_dataset, stage2_extra_context, stage3_reply
+from stage1 import classify_async
+from stage2 import run_stage_2
+from stage3 import run_stage_3_async
+
+# CPU-bound work (Stage 2, Stage 3 tool calls, dataset reattach) runs here
+STAGE2_WORKERS = int(os.getenv("STAGE2_WORKERS", os.cpu_count() or 4))
+stage2_executor = ThreadPoolExecutor(max_workers=STAGE2_WORKERS, thread_name_prefix="stage2")
+
+wsgi_app = WsgiToAsgi(flask_app)
+
+
+async def chat(data):
+    """Async counterpart of ``app.chat``; returns ``(body, status)``."""
+    loop = asyncio.get_running_loop()
+    dataset_id, parser_data = await loop.run_in_executor(stage2_executor, resolve_dataset, data.get('dataset_id'))
+    if parser_data is None:
+        return dataset_error(dataset_id)
+
+    messages = data.get('messages', [])
+    if not messages:
+        return {'error': 'No messages in request'}, 400
+
+    last_message = messages[-1]['content']
+    print("Processing message:", last_message)
+
+    stage1_data = await classify_async(last_message)
+    print("Stage 1 completed!")
+
+    try:
+        stage2_response = await loop.run_in_executor(stage2_executor, run_stage_2, stage1_data, parser_data)
+        print("Stage 2 completed!")
+    except Exception as e:
+        error_msg = f"Stage 2 error: {str(e)}"
+        print(error_msg)
+        return {'error': error_msg}, 500
+
+    extra_context = stage2_extra_context(stage2_response)
+    try:
+        stage3_response = await run_stage_3_async(
+            parsed_data=parser_data,
+            question=last_message,
+            stage2=stage2_response,
+            extra_context=extra_context,
+            executor=stage2_executor
+        )
+        print("Stage 3 completed!")
+    except Exception as e:
+        error_msg = f"Stage 3 error: {str(e)}"
+        print(error_msg)
+        return {'error': error_msg}, 500
+
+    return stage3_reply(stage3_response, dataset_id, stage2_response, extra_context), 200
+
+
+async def clarify(data):
+    """Async counterpart of ``app.clarify``; returns ``(body, status)``."""
+    clarification = data.get("clarification")
+    context = data.get("stage3Context", {})
+    if not clarification or not context:
+        return {'error': 'Missing clarification or context'}, 400
+
+    loop = asyncio.get_running_loop()
+    dataset_id, parser_data = await loop.run_in_executor(
+        stage2_executor, resolve_dataset, data.get('dataset_id') or context.get('dataset_id')
+    )
+    if parser_data is None:
+        return dataset_error(dataset_id)
+
+    messages = context.get("messages", [])
+    messages.append({"role": "user", "content": clarification})
+
+    try:
+        stage3_response = await run_stage_3_async(
+            parsed_data=parser_data,
+            messages=messages,
+            stage2=context.get("stage2"),
+            extra_context=context.get("extra_context"),
+            executor=stage2_executor
+        )
+    except Exception as e:
+        error_msg = f"Stage 3 clarification error: {str(e)}"
+        print(error_msg)
+        return {'error': error_msg}, 500
+
+    return stage3_reply(stage3_response, dataset_id, context.get("stage2"), context.get("extra_context")), 200
+
+
+ROUTES = {
+    "/api/chat": chat,
+    "/api/chat/clarify": clarify,
+}
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        event = await receive()
+        body += event.get("body", b"")
+        if not event.get("more_body"):
+            return bytes(body)
+
+
+async def send_json(send, body, status):
+    payload = json.dumps(body).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+            (b"access-control-allow-origin", b"*"),  # same policy as CORS(app)
+        ],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def lifespan(receive, send):
+    while True:
+        event = await receive()
+        if event["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif event["type"] == "lifespan.shutdown":
+            stage2_executor.shutdown(wait=False, cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    handler = ROUTES.get(scope.get("path")) if scope["type"] == "http" and scope["method"] == "POST" else None
+    if handler is None:
+        # Uploads, CORS preflight and everything else go to the Flask app
+        return await wsgi_app(scope, receive, send)
+
+    try:
+        data = json.loads(await read_body(receive) or b"null")
+    except ValueError:
+        data = None
+    if not data:
+        return await send_json(send, {'error': 'No JSON data received'}, 400)
+
+    try:
+        body, status = await handler(data)
+    except Exception as e:
+        print(f"Error in {scope['path']}:", str(e))
+        body, status = {'error': str(e)}, 500
+    await send_json(send, body, status)
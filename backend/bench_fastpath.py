@@ -0,0 +1,134 @@
+"""
+Benchmark the Stage 1 fast path over the questions in ``test.py``.
+
+Reports how many questions the local rules answer, how often they agree
+with the LLM classifier (or, without ``--llm``, with the intent labels in
+``TEST_QUESTIONS``) and the classification latency that the hits save.
+The rules were written against ``TEST_QUESTIONS``, so the held-out
+questions below are also checked: the benchmark fails if any of them gets
+a different answer, including one it should have left to the LLM.
+
+    python bench_fastpath.py --llm
+"""
+import argparse
+import json
+import time
+from fastpath import FastPathClassifier
+from test import TEST_QUESTIONS
+
+# (question, expected (intent, target), or None when the fast path must defer to the LLM)
+HELD_OUT = [
+    ("What was the altitude at 10 minutes and 30 seconds?", None),
+    ("What was the maximum battery current?", ("max_value", "curr")),
+    ("What was the maximum altitude in the first 10 seconds?", None),
+    ("What was the maximum altitude at 20 seconds?", None),
+    ("What was the lowest speed at 200000 hours?", None),
+    ("Did the voltage change when the flight mode switched?", None),
+    ("Compare the battery voltage and the current draw.", None),
+    ("Is the altitude data reliable?", None),
+    ("What was the highest NSats value?", ("max_value", "nsats")),
+    ("When did the GPS signal get lost?", ("event_detection", "err")),
+    ("What were the 3 lowest battery voltages?", ("min_value", "volt")),
+    ("Were there any VIBE anomalies?", ("anomaly_detection", "vibe")),
+    ("What was the altitude at 150000 feet?", None),
+    ("What was the battery voltage at timestamp 70000000?", ("value_at_time", "volt")),
+    ("What was the maximum vertical speed?", None),
+    ("What was the wind speed at 20 seconds?", None),
+    ("What was the highest motor temperature?", None),
+    ("What was the vehicle's maximum altitude?", ("max_value", "alt")),
+    ("How long was the vehicle in AUTO mode?", None),
+    ("How long was the altitude above 100 m?", None),
+    ("How long was the UAV airborne?", ("time_duration", "timeus")),
+]
+
+
+def best_of(fn, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def llm_classification(question):
+    """Intent and target from the LLM classifier, plus its latency in seconds."""
+    from stage1 import call_intent_classifier
+
+    start = time.perf_counter()
+    raw = call_intent_classifier(question)
+    elapsed = time.perf_counter() - start
+    try:
+        parsed = json.loads(raw)
+        return (parsed.get("intent"), str(parsed.get("target", "")).lower()), elapsed
+    except ValueError:
+        return ("fallback", ""), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--llm", action="store_true", help="Also classify every question with the LLM and compare")
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0,
+                        help="Assumed LLM classification latency when --llm is not given")
+    parser.add_argument("--repeat", type=int, default=100, help="Runs per question (best time is reported)")
+    parser.add_argument("--verbose", action="store_true", help="Print every question and both classifications")
+    args = parser.parse_args()
+
+    with open("field_to_messages.json", "r") as f:
+        field_to_messages = json.load(f)
+    with open("message_definitions.json", "r") as f:
+        message_definitions = json.load(f)
+    fast_path = FastPathClassifier(field_to_messages, message_definitions)
+
+    questions = [(label, question) for label, group in TEST_QUESTIONS.items() for question in group]
+    hits = agreed = 0
+    fast_time = 0.0
+    llm_times = []
+    for label, question in questions:
+        elapsed, result = best_of(lambda: fast_path.classify(question), args.repeat)
+        fast_time += elapsed
+
+        if args.llm:
+            reference, llm_time = llm_classification(question)
+            llm_times.append(llm_time)
+        else:
+            reference = (label, None)
+
+        if result is None:
+            outcome = "-> LLM"
+        else:
+            hits += 1
+            same = result["intent"] == reference[0] and reference[1] in (None, result["target"])
+            agreed += same
+            outcome = "agree" if same else "DIFFER"
+        if args.verbose:
+            print(f"  {outcome:7} {question!r}\n          fast={result} reference={reference}")
+
+    llm_latency = sum(llm_times) / len(llm_times) if llm_times else args.llm_latency_ms / 1e3
+    reference_name = "LLM (intent and target)" if args.llm else "TEST_QUESTIONS labels (intent only, rules tuned on them)"
+    print(f"{len(questions)} questions from TEST_QUESTIONS")
+    print(f"  fast-path hit rate:       {hits}/{len(questions)} ({hits / len(questions):.0%})")
+    if hits:
+        print(f"  agreement with {reference_name}: {agreed}/{hits} ({agreed / hits:.0%})")
+    print(f"  fast-path latency:        {fast_time / len(questions) * 1e6:.1f} us per question")
+    print(f"  LLM latency:              {llm_latency * 1e3:.0f} ms per question"
+          f" ({'measured' if llm_times else 'assumed, pass --llm to measure'})")
+    print(f"  latency saved:            {hits * llm_latency:.1f} s over the set"
+          f" ({hits * llm_latency / len(questions) * 1e3:.0f} ms per question on average)")
+
+    failures = []
+    for question, expected in HELD_OUT:
+        result = fast_path.classify(question)
+        answer = None if result is None else (result["intent"], result["target"])
+        if answer != expected:
+            failures.append((question, expected, answer))
+    print(f"  held-out questions:       {len(HELD_OUT) - len(failures)}/{len(HELD_OUT)} as expected")
+    for question, expected, answer in failures:
+        print(f"    {question!r}: expected {expected or 'LLM'}, got {answer or 'LLM'}")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
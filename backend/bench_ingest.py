@@ -0,0 +1,99 @@
+"""
+Benchmark /api/parser ingest throughput: JSON field arrays vs the binary container.
+
+Generates a synthetic multi-hour MAVLink-style log, encodes it both ways and
+times the backend side of each upload (decode + conversion to a LogDataset).
+
+    python bench_ingest.py --hours 3
+"""
+import argparse
+import json
+import time
+import numpy as np
+from ingest import dataset_from_binary, dataset_from_frontend, encode_binary_container
+
+# (message, rate in Hz, numeric fields)
+SYNTHETIC_MESSAGES = [
+    ("ATTITUDE", 10, ["roll", "pitch", "yaw", "rollspeed", "pitchspeed", "yawspeed"]),
+    ("GLOBAL_POSITION_INT", 5, ["lat", "lon", "alt", "relative_alt", "vx", "vy", "vz", "hdg"]),
+    ("VFR_HUD", 4, ["airspeed", "groundspeed", "heading", "throttle", "alt", "climb"]),
+    ("SYS_STATUS", 1, ["voltage_battery", "current_battery", "battery_remaining", "drop_rate_comm"]),
+]
+
+
+def make_synthetic_log(hours, seed=0):
+    rng = np.random.default_rng(seed)
+    duration_ms = int(hours * 3600 * 1000)
+    messages = {}
+    for name, rate, fields in SYNTHETIC_MESSAGES:
+        # uint32, as MAVLink sends it, so the conversion to microseconds must not wrap
+        time_boot_ms = np.arange(0, duration_ms, 1000 // rate, dtype=np.uint32)
+        columns = {"time_boot_ms": time_boot_ms}
+        for field in fields:
+            columns[field] = np.cumsum(rng.normal(size=len(time_boot_ms)))
+        messages[name] = columns
+    messages["STATUSTEXT"] = {
+        "time_boot_ms": np.arange(0, duration_ms, 60_000, dtype=np.uint32),
+        "text": [f"Status message {i}" for i in range(len(range(0, duration_ms, 60_000)))],
+    }
+    return messages
+
+
+def best_of(fn, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--hours", type=float, default=3.0, help="Synthetic flight length")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per format (best time is reported)")
+    args = parser.parse_args()
+
+    messages = make_synthetic_log(args.hours)
+    total_rows = sum(len(fields["time_boot_ms"]) for fields in messages.values())
+    print(f"Synthetic log: {args.hours:g} h, {len(messages)} message types, {total_rows} rows")
+
+    encode_start = time.perf_counter()
+    json_body = json.dumps({"messages": {
+        name: {field: np.asarray(values).tolist() for field, values in fields.items()}
+        for name, fields in messages.items()
+    }}).encode("utf-8")
+    json_encode = time.perf_counter() - encode_start
+
+    encode_start = time.perf_counter()
+    binary_body = encode_binary_container(messages)
+    binary_encode = time.perf_counter() - encode_start
+
+    json_time, json_dataset = best_of(lambda: dataset_from_frontend(json.loads(json_body)), args.repeat)
+    binary_time, binary_dataset = best_of(lambda: dataset_from_binary(binary_body), args.repeat)
+
+    for msg in json_dataset.keys():
+        for field in json_dataset.fields(msg):
+            expected, actual = json_dataset.column(msg, field), binary_dataset.column(msg, field)
+            if not np.array_equal(expected, actual):
+                raise AssertionError(f"Mismatch in {msg}.{field}")
+        last_us = int(messages[msg.upper()]["time_boot_ms"][-1]) * 1000 if msg.upper() in messages else None
+        if last_us is not None and int(binary_dataset.column(msg, "timeus")[-1]) != last_us:
+            raise AssertionError(f"{msg}.timeus wrapped: expected {last_us}")
+
+    print()
+    print(f"{'Format':<8} | {'Size (MB)':>10} | {'Encode (s)':>10} | {'Ingest (s)':>10} | {'MB/s':>10}")
+    print("-" * 60)
+    for name, body, encode, ingest in [
+        ("json", json_body, json_encode, json_time),
+        ("binary", binary_body, binary_encode, binary_time),
+    ]:
+        size_mb = len(body) / 1e6
+        print(f"{name:<8} | {size_mb:>10.1f} | {encode:>10.3f} | {ingest:>10.4f} | {size_mb / ingest:>10.0f}")
+    print()
+    print(f"Binary ingest is {json_time / binary_time:.0f}x faster than JSON ingest.")
+
+
+if __name__ == "__main__":
+    main()
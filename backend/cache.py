@@ -0,0 +1,118 @@
+import hashlib
+import os
+import shutil
+import uuid
+from dataset import LogDataset, MANIFEST_FILE
+
+# Bump when the on-disk dataset layout or the conversion output changes,
+# so stale entries stop matching instead of being reattached.
+CACHE_FORMAT_VERSION = b"uavlog-dataset-v2"
+
+DEFAULT_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", "dataset_cache")
+DEFAULT_CACHE_MAX_BYTES = int(os.getenv("DATASET_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+
+def new_hasher():
+    """SHA-256 hasher for upload content, salted with the cache format version."""
+    return hashlib.sha256(CACHE_FORMAT_VERSION)
+
+
+def hash_bytes(data):
+    hasher = new_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def hash_file(path, chunk_size=1 << 20):
+    hasher = new_hasher()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class DatasetCache:
+    """
+    Content-addressed on-disk cache of converted datasets.
+
+    Each entry is a ``LogDataset.save`` directory named after the content hash
+    of the original upload or log file. Hits are reattached with
+    ``np.load(mmap_mode='r')``, so they cost a manifest read rather than a
+    conversion. The manifest mtime records the last access, and the least
+    recently used entries are evicted once the cache grows past ``max_bytes``.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """Return the cached dataset for ``key`` memory-mapped read-only, or None."""
+        manifest = os.path.join(self.path(key), MANIFEST_FILE)
+        if not os.path.exists(manifest):
+            return None
+        try:
+            dataset = LogDataset.load(self.path(key), mmap_mode="r")
+            os.utime(manifest)  # mark as recently used
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            # Besides I/O errors: a manifest from an older layout, or one of an unexpected shape
+            print(f"[Warning] Dropping unreadable cache entry {key}: {e!r}")
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            return None
+        return dataset
+
+    def put(self, key, dataset):
+        """Store ``dataset`` under ``key`` (atomically) and evict old entries if over budget."""
+        if os.path.exists(os.path.join(self.path(key), MANIFEST_FILE)):
+            return
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.path(f".tmp-{key}-{uuid.uuid4().hex}")
+        try:
+            dataset.save(tmp_path)
+            os.replace(tmp_path, self.path(key))
+        except OSError:
+            # Another process stored the same key first, or the disk is full
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.exists(os.path.join(self.path(key), MANIFEST_FILE)):
+                raise
+        self.evict(keep=key)
+
+    def entries(self):
+        """List ``(key, last_access, size_bytes)`` for every complete entry."""
+        if not os.path.isdir(self.root):
+            return []
+        entries = []
+        for key in os.listdir(self.root):
+            manifest = os.path.join(self.path(key), MANIFEST_FILE)
+            if key.startswith(".") or not os.path.exists(manifest):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(self.path(key)))
+                entries.append((key, os.path.getmtime(manifest), size))
+            except OSError:
+                continue  # removed concurrently
+        return entries
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in ``max_bytes``."""
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for key, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            total -= size
+            print(f"Evicted cached dataset {key} ({size / 1e6:.1f} MB)")
+
+    def most_recent(self):
+        """Return ``(key, dataset)`` for the most recently used entry, or None if the cache is empty."""
+        for key, _, _ in sorted(self.entries(), key=lambda entry: entry[1], reverse=True):
+            dataset = self.get(key)
+            if dataset is not None:
+                return key, dataset
+        return None
@@ -0,0 +1,823 @@
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import numpy as np
+
+TIME_FIELD = "timeus"
+MANIFEST_FILE = "manifest.json"
+
+# State-like fields (modes, arming, fix type, error codes) are stored as runs
+# when they have enough rows, few distinct values and change rarely.
+RLE_MIN_ROWS = 256
+RLE_MAX_DISTINCT = 64
+RLE_MIN_ROWS_PER_RUN = 32
+
+
+def to_python(value):
+    """Convert a NumPy scalar (or bytes) into a plain JSON-serializable Python value."""
+    if isinstance(value, bytes):
+        return value.decode(errors="ignore")
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def to_column(values):
+    """
+    Build a 1-D column array from a sequence of per-row values.
+
+    Numeric data becomes a typed NumPy array; rows where the field is missing
+    (None) become NaN. Strings, bytes and nested lists are kept in an object
+    array so they can still be compared and returned as-is.
+    """
+    if isinstance(values, np.ndarray) and values.ndim == 1 and values.dtype.kind in "biufO":
+        return values
+
+    try:
+        arr = np.asarray(values)
+    except (ValueError, TypeError):
+        arr = None
+
+    if arr is not None and arr.ndim == 1:
+        if arr.dtype.kind in "biuf":
+            return arr
+        # NumPy also picks 'U' for mixed numbers and strings, stringifying the numbers
+        if arr.dtype.kind == "U" and (isinstance(values, np.ndarray) or all(isinstance(v, str) for v in values)):
+            return arr.astype(object)
+
+    values = list(values)
+    if not any(isinstance(v, (str, bytes)) for v in values):
+        try:
+            column = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            if column.ndim == 1:
+                return column
+        except (ValueError, TypeError):
+            pass
+
+    column = np.empty(len(values), dtype=object)
+    column[:] = [to_python(v) for v in values]
+    return column
+
+
+def convert_columns(msg_type, columns):
+    """Convert a ``{field: values}`` mapping to columns and return it with the shared row count."""
+    converted = {field: to_column(values) for field, values in columns.items()}
+    lengths = {len(col) for col in converted.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"Columns of message '{msg_type}' have different lengths: {sorted(lengths)}")
+    return converted, (lengths.pop() if lengths else 0)
+
+
+def column_bytes(column):
+    """The dtype and values of a column as bytes, for hashing."""
+    if column.dtype == object:
+        return b"O" + json.dumps(column.tolist(), default=str).encode()
+    return column.dtype.str.encode() + np.ascontiguousarray(column).tobytes()
+
+
+def present_mask(column):
+    """Boolean mask of rows where the column holds a value (not NaN / None)."""
+    if column.dtype.kind == "f":
+        return ~np.isnan(column)
+    if column.dtype == object:
+        return np.array([v is not None for v in column], dtype=bool)
+    return np.ones(len(column), dtype=bool)
+
+
+def heap_nbytes(*arrays):
+    """Bytes held by ``arrays`` in process memory; memory-mapped buffers (and None) count as 0."""
+    total = 0
+    for array in arrays:
+        root = array
+        while isinstance(root, np.ndarray) and root.base is not None:
+            root = root.base
+        if array is not None and not isinstance(root, mmap.mmap):
+            total += array.nbytes
+    return total
+
+
+def top_k_indices(values, k, largest=True):
+    """
+    Row indices of the ``k`` largest (or smallest) values, best first, ignoring NaN.
+
+    Uses ``np.argpartition`` so only the selected rows are sorted: O(n + k log k)
+    instead of a full sort of the column.
+    """
+    rows = np.flatnonzero(~np.isnan(values)) if values.dtype.kind == "f" else None
+    if rows is not None and len(rows) == len(values):
+        rows = None
+    candidates = values if rows is None else values[rows]
+    if largest:
+        candidates = -candidates.astype(np.float64)
+
+    k = min(k, len(candidates))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    selected = np.argpartition(candidates, k - 1)[:k] if k < len(candidates) else np.arange(k)
+    selected = selected[np.argsort(candidates[selected], kind="stable")]
+    return selected if rows is None else rows[selected]
+
+
+def column_stats(column, times=None):
+    """
+    Summary statistics for one column, computed in a single vectorized pass.
+
+    Every column gets ``count`` (present values) and ``nan_count`` (missing
+    ones). Numeric columns also get min/max with the row and time at which
+    they occur, plus mean and (population) std of the present values.
+    """
+    if column.dtype.kind not in "biuf":
+        present = int(present_mask(column).sum())
+        return {"count": present, "nan_count": len(column) - present}
+
+    values = column.astype(np.float64, copy=False)
+    valid = ~np.isnan(values)
+    count = int(valid.sum())
+    stats = {"count": count, "nan_count": len(values) - count}
+    if not count:
+        return stats
+
+    rows = None if count == len(values) else np.flatnonzero(valid)
+    present = values if rows is None else values[rows]
+    argmin, argmax = int(np.argmin(present)), int(np.argmax(present))
+    if rows is not None:
+        argmin, argmax = int(rows[argmin]), int(rows[argmax])
+
+    # ±inf samples make the std NaN; that is the intended result, not a warning for the logs
+    with np.errstate(invalid="ignore"):
+        mean, std = float(present.mean()), float(present.std())
+
+    stats.update({
+        "min": float(values[argmin]),
+        "max": float(values[argmax]),
+        "argmin": argmin,
+        "argmax": argmax,
+        "argmin_time": to_python(times[argmin]) if times is not None else None,
+        "argmax_time": to_python(times[argmax]) if times is not None else None,
+        "mean": mean,
+        "std": std
+    })
+    return stats
+
+
+def combine_stats(stats_list):
+    """Pool ``column_stats`` results of the same field across messages (count, min, max, mean, std)."""
+    stats_list = [s for s in stats_list if s and s.get("count") and "mean" in s]
+    if not stats_list:
+        return None
+    counts = np.array([s["count"] for s in stats_list], dtype=np.float64)
+    means = np.array([s["mean"] for s in stats_list])
+    stds = np.array([s["std"] for s in stats_list])
+    with np.errstate(invalid="ignore"):
+        mean = float((counts * means).sum() / counts.sum())
+        variance = float((counts * (stds ** 2 + (means - mean) ** 2)).sum() / counts.sum())
+    return {
+        "count": int(counts.sum()),
+        "min": min(s["min"] for s in stats_list),
+        "max": max(s["max"] for s in stats_list),
+        "mean": mean,
+        "std": math.sqrt(variance)
+    }
+
+
+def time_distance(times, time_us):
+    """``|times - time_us|`` that stays correct for unsigned (DataFlash ``Q``) timestamps."""
+    if times.dtype.kind == "u":
+        times = times.astype(np.int64)
+    return np.abs(times - time_us)
+
+
+class TimeIndex:
+    """
+    Sorted ``timeus`` index for one message type.
+
+    Built once when the message is ingested. ``times`` holds the finite
+    timestamps in ascending order as int64 or float64, and ``rows`` the row
+    each one came from (None when the column is already sorted and complete,
+    so the index is just a view of the column). Window and nearest-sample
+    lookups are then a ``searchsorted`` away instead of a scan over every row.
+    """
+
+    def __init__(self, times):
+        if times.dtype.kind == "f":
+            times = times.astype(np.float64, copy=False)
+            valid = ~np.isnan(times)
+            valid = None if valid.all() else valid
+        else:
+            # Unsigned timestamps are viewed as int64 so lookups never promote the whole array
+            times = times.view(np.int64) if times.dtype == np.uint64 else times.astype(np.int64, copy=False)
+            valid = None
+
+        if valid is None and (len(times) < 2 or (times[1:] >= times[:-1]).all()):
+            self.times = times
+            self.rows = None
+            return
+
+        rows = np.flatnonzero(valid) if valid is not None else np.arange(len(times))
+        rows = rows[np.argsort(times[rows], kind="stable")]
+        self.times = times[rows]
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.times)
+
+    def _position(self, time_us, side):
+        """``searchsorted`` for a query time, without casting the index to the query's type."""
+        if self.times.dtype.kind == "i" and not float(time_us).is_integer():
+            if math.isnan(time_us):
+                return len(self.times)
+            if math.isinf(time_us):
+                return 0 if time_us < 0 else len(self.times)
+            # Between two integers: times >= t is times >= ceil(t), times <= t is times <= floor(t)
+            time_us = math.ceil(time_us) if side == "left" else math.floor(time_us)
+        return int(np.searchsorted(self.times, int(time_us) if self.times.dtype.kind == "i" else time_us, side=side))
+
+    def _to_rows(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        return positions if self.rows is None else self.rows[positions]
+
+    def window(self, start, end):
+        """Row indices with ``start <= timeus <= end``, in time order."""
+        lo = self._position(start, "left")
+        hi = self._position(end, "right")
+        return self._to_rows(np.arange(lo, max(lo, hi)))
+
+    def nearest(self, time_us, k=1):
+        """Row indices of the ``k`` samples closest to ``time_us``, closest first."""
+        pos = self._position(time_us, "left")
+        lo, hi = max(0, pos - k), min(len(self.times), pos + k)
+        diffs = np.abs(self.times[lo:hi] - time_us)
+        return self._to_rows(lo + np.argsort(diffs, kind="stable")[:k])
+
+    @property
+    def nbytes(self):
+        return 0 if self.rows is None else self.rows.nbytes + self.times.nbytes
+
+
+def _run_starts(column):
+    """Row index where each run of equal consecutive values starts (NaN/None runs included)."""
+    if not len(column):
+        return np.empty(0, dtype=np.int64)
+    changed = column[1:] != column[:-1]
+    if column.dtype.kind == "f":
+        changed &= ~(np.isnan(column[1:]) & np.isnan(column[:-1]))
+    return np.concatenate([[0], np.flatnonzero(changed) + 1]).astype(np.int64)
+
+
+class RunLengthColumn:
+    """
+    A column stored as runs of repeated values.
+
+    ``starts`` holds the first row of each run and ``values`` its value, so
+    lookups, transitions and time-in-state work on the runs instead of the
+    samples. Indexing with a row (or an array of rows) returns the same values
+    the dense column would; ``decode`` expands it back to a full array.
+    """
+
+    def __init__(self, starts, values, length):
+        self.starts = starts
+        self.values = values
+        self.length = length
+
+    @classmethod
+    def encode(cls, column):
+        starts = _run_starts(column)
+        return cls(starts, column[starts], len(column))
+
+    @classmethod
+    def maybe_encode(cls, column):
+        """Return the column run-length encoded if it looks like a discrete state field, else None."""
+        if len(column) < RLE_MIN_ROWS or column.dtype.kind not in "biufO":
+            return None
+        starts = _run_starts(column)
+        if len(starts) * RLE_MIN_ROWS_PER_RUN > len(column):
+            return None
+        values = column[starts]
+        try:
+            distinct = len(np.unique(values)) if values.dtype != object else len(set(values.tolist()))
+        except TypeError:
+            return None  # unhashable values such as arrays
+        if distinct > RLE_MAX_DISTINCT:
+            return None
+        return cls(starts, values, len(column))
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.values.nbytes
+
+    @property
+    def ends(self):
+        """Exclusive end row of each run."""
+        return np.append(self.starts[1:], self.length)
+
+    def run_of(self, rows):
+        return np.searchsorted(self.starts, rows, side="right") - 1
+
+    def __getitem__(self, rows):
+        if isinstance(rows, slice):
+            rows = np.arange(self.length)[rows]
+        elif np.ndim(rows) == 0 and rows < 0:
+            rows += self.length
+        return self.values[self.run_of(rows)]
+
+    def decode(self):
+        return np.repeat(self.values, np.diff(self.ends, prepend=0))
+
+    def time_runs(self, times):
+        """
+        Runs as ``(start_time, end_time, value)`` arrays.
+
+        A state holds until the next run starts; the last run ends at the
+        final sample.
+        """
+        start_times = times[self.starts]
+        end_times = times[np.append(self.starts[1:], self.length - 1)]
+        if times.dtype.kind == "u":
+            start_times, end_times = start_times.astype(np.int64), end_times.astype(np.int64)
+        return start_times, end_times, self.values
+
+
+class Transitions:
+    """
+    Rows where a column's value changes, skipping missing samples.
+
+    Only row indices are computed (``rows`` holds the first row of each new
+    value, ``previous_rows`` the last row of the value it replaced). Values,
+    times and full rows are looked up when evidence is built, so callers can
+    sample or cap the transitions before materializing anything.
+    """
+
+    def __init__(self, column, times=None):
+        # Run-length encoded columns are compared run by run rather than sample by sample
+        runs = column if isinstance(column, RunLengthColumn) else None
+        column_values = runs.values if runs is not None else column
+
+        present = None if column_values.dtype.kind in "biu" else np.flatnonzero(present_mask(column_values))
+        if present is not None and len(present) == len(column_values):
+            present = None
+        values = column_values if present is None else column_values[present]
+
+        if values.dtype.kind in "iuf":
+            changed = np.flatnonzero(np.diff(values))
+        else:
+            changed = np.flatnonzero(values[1:] != values[:-1])
+
+        new = changed + 1 if present is None else present[changed + 1]
+        previous = changed if present is None else present[changed]
+
+        self.column = column
+        self.times = times
+        if runs is None:
+            self.rows, self.previous_rows = new, previous
+        else:
+            self.rows, self.previous_rows = runs.starts[new], runs.ends[previous] - 1
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self):
+        """Bytes of the row indices (the column and times belong to the dataset)."""
+        return heap_nbytes(self.rows, self.previous_rows)
+
+    def time_values(self):
+        """Timestamps of all transitions as an array (None without a time column)."""
+        return None if self.times is None else self.times[self.rows]
+
+    def magnitudes(self):
+        """Absolute size of every change (zeros for non-numeric columns)."""
+        if self.column.dtype.kind not in "biuf":
+            return np.zeros(len(self.rows))
+        new = self.column[self.rows].astype(np.float64)
+        return np.abs(new - self.column[self.previous_rows].astype(np.float64))
+
+    def old_value(self, i):
+        return to_python(self.column[self.previous_rows[i]])
+
+    def new_value(self, i):
+        return to_python(self.column[self.rows[i]])
+
+    def time(self, i):
+        return None if self.times is None else to_python(self.times[self.rows[i]])
+
+
+class LogDataset:
+    """
+    Columnar store for a parsed flight log.
+
+    Each message type maps to a dict of equally long 1-D NumPy arrays, one per
+    field, including a shared ``timeus`` array when the message is timestamped.
+    Rows are only materialized as dicts on demand (e.g. for evidence).
+
+    When a message is stored its timestamps are indexed (``time_index``) and
+    every field is summarized once (``field_stats``), so repeated questions
+    about the same flight do not rescan the columns. ``schema`` catalogs each
+    message's fields, dtypes, row count and time span. Discrete state fields
+    are kept as ``RunLengthColumn`` runs; ``column`` expands them on demand
+    while ``runs``, ``values_at`` and ``transitions`` work on the runs.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.time_indexes = {}
+        self.stats = {}
+        self.derived_cache = {}
+        self.schema = {}
+        self.all_fields = None
+        self.content_fingerprint = None
+
+    def add_message(self, msg_type, columns):
+        """Store (or replace) a message type from a ``{field: values}`` mapping."""
+        self.set_columns(msg_type, convert_columns(msg_type, columns)[0])
+
+    def set_columns(self, msg_type, columns, stats=None, encode_runs=True):
+        """
+        Store already converted columns for a message type.
+
+        Builds the message's time index and its per-field statistics catalog
+        (unless ``stats`` already computed for these columns are passed in),
+        and run-length encodes state-like fields when ``encode_runs`` is set.
+        """
+        self.derived_cache = {
+            key: value for key, value in self.derived_cache.items() if key[0] != msg_type
+        }
+        times = columns.get(TIME_FIELD)
+        if times is not None and times.dtype.kind in "biuf":
+            self.time_indexes[msg_type] = TimeIndex(times)
+        else:
+            self.time_indexes.pop(msg_type, None)
+
+        stats = dict(stats or {})
+        for field, column in columns.items():
+            if field not in stats:
+                dense = column.decode() if isinstance(column, RunLengthColumn) else column
+                stats[field] = column_stats(dense, times)
+        self.stats[msg_type] = stats
+
+        if encode_runs:
+            columns = dict(columns)
+            for field, column in columns.items():
+                if field != TIME_FIELD and isinstance(column, np.ndarray):
+                    columns[field] = RunLengthColumn.maybe_encode(column) or column
+        self.columns[msg_type] = columns
+
+        index = self.time_indexes.get(msg_type)
+        has_span = index is not None and len(index)
+        self.schema[msg_type] = {
+            "rows": len(next(iter(columns.values()))) if columns else 0,
+            "fields": {field: column.dtype.name for field, column in columns.items()},
+            "start_time": to_python(index.times[0]) if has_span else None,
+            "end_time": to_python(index.times[-1]) if has_span else None
+        }
+        self.all_fields = None
+        self.content_fingerprint = None
+
+    # --- Mapping-style access -------------------------------------------------
+
+    def keys(self):
+        return self.columns.keys()
+
+    def __contains__(self, msg_type):
+        return msg_type in self.columns
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    # --- Column access --------------------------------------------------------
+
+    def num_rows(self, msg_type):
+        return self.schema[msg_type]["rows"] if msg_type in self.schema else 0
+
+    def fields(self, msg_type):
+        return list(self.schema.get(msg_type, {}).get("fields", {}))
+
+    def has_field(self, msg_type, field):
+        return field in self.columns.get(msg_type, {})
+
+    def fingerprint(self):
+        """
+        Hash of every column's name, dtype and values, identifying the log's content.
+
+        Logs kept in a ``DatasetStore`` use their ``dataset_id`` (the hash of
+        the uploaded file) instead, so the same flight gets the same
+        fingerprint whether it was just converted or reattached from the cache.
+        """
+        if self.content_fingerprint is None:
+            digest = hashlib.sha256()
+            for msg_type in sorted(self.columns):
+                for field, column in sorted(self.columns[msg_type].items()):
+                    runs = isinstance(column, RunLengthColumn)
+                    parts = (column.starts, column.values) if runs else (column,)
+                    digest.update(f"{msg_type}.{field}:{'runs' if runs else 'dense'}:".encode())
+                    for part in parts:
+                        digest.update(column_bytes(part))
+            self.content_fingerprint = digest.hexdigest()
+        return self.content_fingerprint
+
+    def available_fields(self):
+        """Sorted names of every field in any message, from the schema catalog."""
+        if self.all_fields is None:
+            self.all_fields = sorted({field for entry in self.schema.values() for field in entry["fields"]})
+        return self.all_fields
+
+    def column(self, msg_type, field):
+        """Return the column as a dense array, or None if the message lacks the field."""
+        column = self.columns.get(msg_type, {}).get(field)
+        if isinstance(column, RunLengthColumn):
+            return column.decode()
+        return column
+
+    def runs(self, msg_type, field):
+        """Return the field's ``RunLengthColumn`` if it is stored run-length encoded, else None."""
+        column = self.columns.get(msg_type, {}).get(field)
+        return column if isinstance(column, RunLengthColumn) else None
+
+    def values_at(self, msg_type, field, rows):
+        """Values of a field at a row (or array of rows) without expanding encoded columns."""
+        return self.columns[msg_type][field][rows]
+
+    def timeus(self, msg_type):
+        return self.column(msg_type, TIME_FIELD)
+
+    def numeric_column(self, msg_type, field):
+        """Return the column as float64 (missing rows as NaN), or None if it is not numeric."""
+        column = self.column(msg_type, field)
+        if column is None:
+            return None
+        if column.dtype.kind in "biuf":
+            return column.astype(np.float64, copy=False)
+        return None
+
+    def field_stats(self, msg_type, field):
+        """Return the precomputed ``column_stats`` of a field, or None if the message lacks it."""
+        return self.stats.get(msg_type, {}).get(field)
+
+    def derived(self, msg_type, field, kind, build):
+        """Return ``build()`` memoized per (message, field, kind) until the message is replaced."""
+        key = (msg_type, field, kind)
+        value = self.derived_cache.get(key)
+        if value is None and key not in self.derived_cache:
+            # Concurrent tool calls may build the same entry; the first one stored wins
+            value = self.derived_cache.setdefault(key, build())
+        return value
+
+    def transitions(self, msg_type, field):
+        """Return the (cached) ``Transitions`` of a field, or None if the message lacks it."""
+        column = self.columns.get(msg_type, {}).get(field)
+        if column is None:
+            return None
+        return self.derived(msg_type, field, "transitions", lambda: Transitions(column, self.timeus(msg_type)))
+
+    def top_k(self, field, message_types, k, largest=True):
+        """
+        The ``k`` largest (or smallest) values of a field across messages.
+
+        Each message contributes its own top ``k`` rows, which are then merged,
+        so the result is exact. Returns ``(message, row)`` pairs, best first.
+        """
+        candidates = []
+        for msg in message_types:
+            values = self.numeric_column(msg, field)
+            if values is None:
+                continue
+            for row in top_k_indices(values, k, largest):
+                candidates.append((float(values[row]), msg, int(row)))
+        candidates.sort(key=lambda c: -c[0] if largest else c[0])
+        return [(msg, row) for _, msg, row in candidates[:k]]
+
+    def time_series(self, msg_type, field):
+        """
+        ``(times, values)`` of a numeric field in time order, or None.
+
+        Times come from the message's ``TimeIndex`` and values are float64 with
+        missing samples as NaN; no copy is made when the log is already sorted.
+        """
+        index = self.time_index(msg_type)
+        values = self.numeric_column(msg_type, field)
+        if index is None or values is None:
+            return None
+        return index.times, values if index.rows is None else values[index.rows]
+
+    def time_index(self, msg_type):
+        """Return the message's sorted ``TimeIndex``, or None if it has no numeric timestamps."""
+        return self.time_indexes.get(msg_type)
+
+    def time_at(self, msg_type, index):
+        times = self.timeus(msg_type)
+        if times is None:
+            return None
+        return to_python(times[index])
+
+    def row(self, msg_type, index):
+        """Materialize a single row as a dict of plain Python values."""
+        row = {}
+        for field, column in self.columns.get(msg_type, {}).items():
+            value = column[index]
+            if value is None or (column.dtype.kind == "f" and np.isnan(value)):
+                continue
+            row[field] = to_python(value)
+        return row
+
+    def rows(self, msg_type, indices):
+        return [self.row(msg_type, int(i)) for i in indices]
+
+    # --- Persistence ----------------------------------------------------------
+
+    def save(self, directory):
+        """
+        Write the dataset as one ``.npy`` file per numeric column plus a manifest.
+
+        Non-numeric (object) columns and the statistics catalog are stored
+        inline in the manifest, so reloading (e.g. from the cache) does not
+        rescan the columns. The manifest is written last, so a directory with
+        a manifest is complete.
+        """
+        os.makedirs(directory, exist_ok=True)
+        manifest = {"messages": {}}
+
+        for msg_type, columns in self.columns.items():
+            fields = {}
+            for field, column in columns.items():
+                name = re.sub(r'[^\w.-]', '_', f"{msg_type}.{field}")
+                spec = {}
+                if isinstance(column, RunLengthColumn):
+                    np.save(os.path.join(directory, name + ".runs.npy"), column.starts)
+                    spec = {"runs": name + ".runs.npy", "rows": column.length}
+                    name, column = name + ".values", column.values
+
+                if column.dtype == object:
+                    spec["values"] = [to_python(v) for v in column]
+                else:
+                    np.save(os.path.join(directory, name + ".npy"), np.ascontiguousarray(column))
+                    spec.update({"file": name + ".npy", "dtype": column.dtype.str})
+                fields[field] = spec
+            manifest["messages"][msg_type] = {
+                "rows": self.num_rows(msg_type),
+                "fields": fields,
+                "stats": self.stats.get(msg_type, {})
+            }
+
+        tmp_path = os.path.join(directory, MANIFEST_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(directory, MANIFEST_FILE))
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        """Load a dataset written by ``save``; pass ``mmap_mode='r'`` to memory-map the columns."""
+        with open(os.path.join(directory, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        dataset = cls()
+        for msg_type, message in manifest["messages"].items():
+            columns = {}
+            for field, spec in message["fields"].items():
+                if "file" in spec:
+                    column = np.load(os.path.join(directory, spec["file"]), mmap_mode=mmap_mode)
+                else:
+                    column = to_column(spec["values"])
+                if "runs" in spec:
+                    starts = np.load(os.path.join(directory, spec["runs"]))
+                    column = RunLengthColumn(starts, column, spec["rows"])
+                columns[field] = column
+            dataset.set_columns(msg_type, columns, stats=message.get("stats"), encode_runs=False)
+        return dataset
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the column buffers."""
+        return sum(
+            column.nbytes
+            for columns in self.columns.values()
+            for column in columns.values()
+        )
+
+    @property
+    def memory_nbytes(self):
+        """
+        Like ``nbytes`` but excluding memory-mapped columns, which the OS can page out,
+        and including time indexes and ``derived_cache`` entries, which grow as questions
+        are answered. A derived series that reuses an in-memory float64 column is
+        counted again, so the estimate errs high.
+        """
+        return sum(
+            column.nbytes
+            for columns in self.columns.values()
+            for column in columns.values()
+            if not isinstance(column, np.memmap)
+        ) + sum(index.nbytes for index in self.time_indexes.values()) + sum(
+            value.nbytes for value in list(self.derived_cache.values()) if value is not None
+        )
+
+
+def _as_dtype(column, dtype):
+    """Cast a column, keeping missing float values as None when moving to an object column."""
+    if dtype == object and column.dtype.kind == "f":
+        converted = column.astype(object)
+        converted[np.isnan(column)] = None
+        return converted
+    return column
+
+
+class ColumnBuffer:
+    """
+    Append-only typed column that grows geometrically.
+
+    The dtype follows the data appended so far (int -> float -> object), and
+    missing rows are stored as NaN / None like everywhere else in the dataset.
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.data = None
+        self.size = 0
+
+    def _reserve(self, count, dtype):
+        if self.data is None:
+            self.data = np.empty(max(self.capacity, count), dtype=dtype)
+            return
+
+        new_dtype = np.result_type(self.data.dtype, dtype)
+        if new_dtype != self.data.dtype:
+            old = self.data[:self.size]
+            self.data = np.empty(len(self.data), dtype=new_dtype)
+            self.data[:self.size] = _as_dtype(old, new_dtype)
+
+        if self.size + count > len(self.data):
+            grown = np.empty(max(2 * len(self.data), self.size + count), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+
+    def extend(self, column):
+        self._reserve(len(column), column.dtype)
+        self.data[self.size:self.size + len(column)] = _as_dtype(column, self.data.dtype)
+        self.size += len(column)
+
+    def extend_missing(self, count):
+        if count <= 0:
+            return
+        if self.data is not None and self.data.dtype == object:
+            self.extend(np.full(count, None, dtype=object))
+        else:
+            self.extend(np.full(count, np.nan))
+
+    def to_array(self):
+        """Return the filled part as a right-sized array (dropping spare capacity)."""
+        if self.data is None:
+            return np.empty(0)
+        return self.data[:self.size].copy()
+
+
+class DatasetBuilder:
+    """
+    Accumulates column chunks per message type and assembles a LogDataset.
+
+    Used by the streaming upload path and the on-disk log reader: each chunk
+    is converted as it arrives and appended to growable typed buffers, so only
+    the column data is retained, never the decoded JSON or message objects.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+        self.row_counts = {}
+
+    def append(self, msg_type, columns):
+        converted, length = convert_columns(msg_type, columns)
+        buffers = self.buffers.setdefault(msg_type, {})
+        rows_before = self.row_counts.get(msg_type, 0)
+
+        for field, column in converted.items():
+            buffer = buffers.get(field)
+            if buffer is None:
+                buffer = buffers[field] = ColumnBuffer()
+                buffer.extend_missing(rows_before)
+            buffer.extend(column)
+
+        for field, buffer in buffers.items():
+            if field not in converted:
+                buffer.extend_missing(length)
+
+        self.row_counts[msg_type] = rows_before + length
+        return length
+
+    def build(self):
+        dataset = LogDataset()
+        for msg_type in list(self.buffers):
+            buffers = self.buffers.pop(msg_type)
+            dataset.set_columns(msg_type, {field: buffer.to_array() for field, buffer in buffers.items()})
+        return dataset
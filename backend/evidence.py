@@ -0,0 +1,141 @@
+import json
+import os
+import numpy as np
+from dataset import LogDataset, TIME_FIELD, present_mask
+from sanitize import json_column
+
+# Roughly 4 bytes per token, so the default keeps Stage 2 evidence near 6k prompt tokens
+DEFAULT_EVIDENCE_BUDGET_BYTES = int(os.getenv("EVIDENCE_BUDGET_BYTES", 24_000))
+COMPACT = (",", ":")
+
+
+def row_ref(msg_type, index):
+    """Reference to one row of a message, resolved into a row table by ``materialize_evidence``."""
+    return {"message_type": msg_type, "row_index": int(index)}
+
+
+def is_row_ref(item):
+    return isinstance(item, dict) and "row_index" in item and "message_type" in item
+
+
+def collect_row_refs(evidence, refs=None):
+    """Map each message to the set of row indices referenced anywhere in ``evidence``."""
+    refs = {} if refs is None else refs
+    if isinstance(evidence, dict):
+        if is_row_ref(evidence):
+            refs.setdefault(evidence["message_type"], set()).add(evidence["row_index"])
+        for value in evidence.values():
+            if isinstance(value, (dict, list)):
+                collect_row_refs(value, refs)
+    elif isinstance(evidence, list):
+        for item in evidence:
+            collect_row_refs(item, refs)
+    return refs
+
+
+def row_tables(dataset: LogDataset, refs, columns=None):
+    """
+    Referenced rows as one table per message: the column names once, then a
+    ``{row_index: [values]}`` map. ``columns`` may limit each message to a
+    subset of its fields; columns with no value in any referenced row are dropped.
+    """
+    tables = {}
+    for msg, indices in refs.items():
+        rows = np.array(sorted(indices), dtype=np.int64)
+        names = [f for f in (columns or {}).get(msg, dataset.fields(msg)) if dataset.has_field(msg, f)]
+        if TIME_FIELD in names:
+            names.remove(TIME_FIELD)
+            names.insert(0, TIME_FIELD)
+
+        kept, values = [], []
+        for field in names:
+            column = dataset.values_at(msg, field, rows)
+            present = present_mask(column)
+            if present.any():
+                kept.append(field)
+                values.append(json_column(column))
+
+        tables[msg] = {
+            "columns": kept,
+            "rows": {str(row): [column[i] for column in values] for i, row in enumerate(rows.tolist())}
+        }
+    return tables
+
+
+def encoded_size(payload):
+    return len(json.dumps(payload, separators=COMPACT, default=str))
+
+
+def _thin(evidence, fraction):
+    """Keep about ``fraction`` of every list of evidence items (keeping both ends), returning the new evidence and whether anything changed."""
+    if isinstance(evidence, list):
+        if len(evidence) > 2 and all(isinstance(item, dict) for item in evidence):
+            count = min(len(evidence) - 1, max(2, int(len(evidence) * fraction)))
+            keep = np.unique(np.linspace(0, len(evidence) - 1, count).astype(int))
+            return [evidence[i] for i in keep], True
+        thinned = [_thin(item, fraction) for item in evidence]
+        return [item for item, _ in thinned], any(changed for _, changed in thinned)
+    if isinstance(evidence, dict):
+        thinned = {key: _thin(value, fraction) for key, value in evidence.items()}
+        return {key: value for key, (value, _) in thinned.items()}, any(changed for _, changed in thinned.values())
+    return evidence, False
+
+
+def _count_items(evidence):
+    if isinstance(evidence, list):
+        return len(evidence) if all(isinstance(item, dict) for item in evidence) else sum(map(_count_items, evidence))
+    if isinstance(evidence, dict):
+        return sum(_count_items(value) for value in evidence.values())
+    return 0
+
+
+def materialize_evidence(evidence, dataset: LogDataset, budget_bytes=DEFAULT_EVIDENCE_BUDGET_BYTES, columns=None):
+    """
+    Resolve row references in Stage 2 evidence into compact row tables that fit a byte budget.
+
+    Referenced rows are deduplicated and sent once per message as a table. If
+    the encoded result is over ``budget_bytes``, the row tables are dropped
+    first (evidence items keep their own value and time), then evidence lists
+    are thinned evenly, in proportion to the overshoot, until the result fits.
+
+    Args:
+        evidence: Stage 2 evidence (list or dict) containing ``row_ref`` items
+        dataset (LogDataset): Log the references point into
+        budget_bytes (int): Limit on the compact JSON encoding of the result
+        columns (dict, optional): Message type to the fields to include in its rows
+
+    Returns:
+        dict: ``evidence``, ``rows`` (per-message tables) and, if anything was cut, ``truncated``
+    """
+    if not evidence:
+        return {"evidence": evidence, "rows": {}}
+
+    payload = {"evidence": evidence, "rows": {}}
+    if encoded_size(payload) <= budget_bytes:
+        payload["rows"] = row_tables(dataset, collect_row_refs(evidence), columns)
+        if encoded_size(payload) <= budget_bytes:
+            return payload
+        payload["rows"] = {}
+
+    # Items of one list encode to similar sizes, so cutting every list to the
+    # budget's share of the current size usually fits in one or two passes
+    total = _count_items(evidence)
+    size = encoded_size(payload)
+    while size > budget_bytes:
+        evidence, changed = _thin(payload["evidence"], 0.95 * budget_bytes / size)
+        if not changed:
+            break
+        payload["evidence"] = evidence
+        size = encoded_size(payload)
+
+    # Thinning may leave room for the rows of the items that were kept
+    rows = row_tables(dataset, collect_row_refs(payload["evidence"]), columns)
+    if encoded_size(dict(payload, rows=rows)) <= budget_bytes:
+        payload["rows"] = rows
+
+    payload["truncated"] = {
+        "rows_omitted": not payload["rows"],
+        "evidence_items_kept": _count_items(payload["evidence"]),
+        "evidence_items_total": total
+    }
+    return payload
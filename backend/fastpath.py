@@ -0,0 +1,237 @@
+import os
+import re
+
+# Below this confidence the fast path declines and the query goes to the LLM
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", 0.6))
+
+# Phrases that name a telemetry source, as (target, target_type). Where phrases
+# overlap, the longest one wins, so "battery voltage" beats "battery". Entries whose
+# target is not in field_to_messages / message_definitions are dropped at load time.
+TARGET_PHRASES = {
+    "altitude": ("alt", "field"),
+    "height": ("alt", "field"),
+    "battery voltage": ("volt", "field"),
+    "voltage": ("volt", "field"),
+    "battery current": ("curr", "field"),
+    "current draw": ("curr", "field"),
+    "current": ("curr", "field"),
+    "battery temperature": ("temp", "field"),
+    "temperature": ("temp", "field"),
+    "gps speed": ("spd", "field"),
+    "ground speed": ("spd", "field"),
+    "groundspeed": ("spd", "field"),
+    "speed": ("spd", "field"),
+    "airspeed": ("airspeed", "field"),
+    "rc signal strength": ("rssi", "field"),
+    "signal strength": ("rssi", "field"),
+    "rssi": ("rssi", "field"),
+    "satellites": ("nsats", "field"),
+    "hdop": ("hdop", "field"),
+    "flight mode": ("mode", "message"),
+    "mode": ("mode", "message"),
+    "gps fix": ("gps", "message"),
+    "gps signal": ("gps", "message"),
+    "gps": ("gps", "message"),
+    "battery": ("bat", "message"),
+    "errors": ("err", "message"),
+    "error": ("err", "message"),
+    "failsafe": ("err", "message"),
+    "failsafe mode": ("err", "message"),
+    "arm": ("arm", "message"),
+    "armed": ("arm", "message"),
+    "disarm": ("arm", "message"),
+    "vibration": ("vibe", "message"),
+}
+
+# Words that may directly precede a target phrase. Any other word there is taken
+# as a noun modifier that names a different source ("vertical speed", "motor
+# temperature", "wind speed"), and the query goes to the LLM.
+VEHICLE_WORDS = {"vehicle", "vehicle's", "drone", "drone's", "uav", "uav's", "aircraft", "aircraft's",
+                 "copter", "copter's", "plane", "plane's"}
+PHRASE_LEAD_WORDS = VEHICLE_WORDS | {
+    # determiners, pronouns, prepositions and auxiliaries
+    "a", "an", "the", "any", "all", "each", "every", "some", "no", "its", "their", "my", "our", "this", "that",
+    "these", "those", "of", "in", "on", "at", "for", "from", "to", "by", "with", "and", "or", "about", "during",
+    "across", "over", "between", "before", "after", "than", "is", "was", "are", "were", "be", "been", "did",
+    "does", "do", "has", "had", "have", "what", "which", "when", "how", "where", "why", "there", "me", "it",
+    # words that qualify a reading without changing its source
+    "max", "maximum", "highest", "peak", "largest", "greatest", "biggest", "top", "min", "minimum", "lowest",
+    "smallest", "average", "mean", "avg", "overall", "total", "measured", "recorded", "reported", "logged",
+    "first", "last", "final", "initial", "critical", "unusual", "abnormal", "anomalous", "sudden", "drastic",
+    "significant", "sharp", "high", "low",
+    # verbs taking the target as their object
+    "enter", "entered", "exit", "exited", "lose", "lost", "get", "got", "show", "see", "change", "changed",
+    "switch", "switched", "drop", "dropped", "reach", "reached", "exceed", "exceeded", "summarize", "describe",
+}
+PRECEDING_WORD = re.compile(r"([\w']+)\s+$")
+
+# Duration questions are only answered as flight length. One that names a state, a
+# value or a condition ("in AUTO mode", "above 100 m", "remain stable") asks for time
+# in a state, which the fast path cannot express, so it goes to the LLM.
+DURATION_CONDITION = re.compile(r"\bin (?!the air\b|flight\b)|\b(above|below|over|under|exceed\w*|while|until|"
+                                r"at (least|most)|stable|remain\w*|stay\w*|spent)\b|\d")
+
+# Event questions about losing something are answered from ERR, as the LLM prompt asks
+LOSS_WORDS = re.compile(r"\b(lost|loss|lose|losing|dropout|dropped out)\b")
+
+# Keywords that each point at one intent. A query whose keywords point at two
+# different intents is ambiguous and goes to the LLM.
+INTENT_RULES = [
+    ("anomaly_detection", re.compile(r"\b(anomal\w*|unusual|abnormal\w*|unexpected\w*|outliers?|spik\w*|glitch\w*)\b")),
+    ("event_detection", re.compile(r"\b(chang(e|es|ed) (in)?to|lost|loss|lose|losing|dropout|failsafe|arm(ed|ing)?|disarm\w*|acquired|errors?)\b")),
+    ("change_detection", re.compile(r"\b(chang\w*(?! (in)?to\b)|drop\w* (significantly|sharply|suddenly)|drastic\w*|transitions?|switch\w*)\b")),
+    ("max_value", re.compile(r"\b(max|maximum|highest|peak|largest|greatest|top)\b")),
+    ("min_value", re.compile(r"\b(min|minimum|lowest|smallest)\b")),
+    ("time_duration", re.compile(r"\b(how long|duration|total flight time|time in the air|airborne)\b")),
+    ("summary", re.compile(r"\b(summar\w*|overview|statistics|stats)\b")),
+]
+# Phrasing typical of event questions, used only when no keyword above matched
+WEAK_EVENT = re.compile(r"\b(when did|when was|first|were there any|did the \w+ ever)\b")
+
+# How sure each way of resolving the intent and target is; a result's confidence is their product
+INTENT_CONFIDENCE = {"keyword": 1.0, "timestamp": 1.0, "weak": 0.6}
+TARGET_CONFIDENCE = {"phrase": 1.0, "loss": 0.9, "identifier": 0.9, "default": 0.8}
+
+TOP_K = re.compile(r"\b(\d+) (highest|largest|greatest|biggest|top|lowest|smallest|peak)\b|\btop (\d+)\b")
+TIME_UNITS_US = {"us": 1, "µs": 1, "microsecond": 1, "microseconds": 1, "ms": 1_000, "millisecond": 1_000,
+                 "milliseconds": 1_000, "s": 1_000_000, "sec": 1_000_000, "secs": 1_000_000,
+                 "second": 1_000_000, "seconds": 1_000_000, "min": 60_000_000, "mins": 60_000_000,
+                 "minute": 60_000_000, "minutes": 60_000_000}
+AT_TIME = re.compile(r"\b(?:at|after)\s+(?:timestamp\s+|time\s+|t\s*=\s*)?(\d+(?:\.\d+)?)\s*([a-zµ]+)?")
+NUMBER = re.compile(r"\d+(?:\.\d+)?")
+TIME_QUANTITY = re.compile(r"\b\d+(?:\.\d+)?\s*(us|µs|ms|s|secs?|seconds?|mins?|minutes?|h|hrs?|hours?|"
+                           r"microseconds?|milliseconds?)\b")
+CLOCK_TIME = re.compile(r"\b\d{1,2}:\d{2}(:\d{2})?\b")
+# Bare numbers this large are timestamps in microseconds (the log's time base)
+MIN_BARE_TIMESTAMP_US = 100_000
+
+IDENTIFIER = re.compile(r"\b[A-Za-z][A-Za-z0-9_]*\b")
+
+
+class FastPathClassifier:
+    """
+    Rule-based Stage 1 classifier for common question shapes.
+
+    Resolves the intent from keyword rules, the target from a phrase table
+    (or an ArduPilot name written as an identifier, e.g. "NSats", "VIBE")
+    checked against ``field_to_messages`` and ``message_definitions``,
+    and ``query_time_us`` from a single explicit timestamp. Each way of
+    resolving the intent and the target carries a confidence; ``classify``
+    returns None, and the caller asks the LLM, when the query is ambiguous
+    or the combined confidence is below ``min_confidence``.
+    """
+
+    def __init__(self, field_to_messages, message_definitions, min_confidence=FAST_PATH_MIN_CONFIDENCE):
+        self.field_to_messages = field_to_messages
+        self.message_definitions = message_definitions
+        self.min_confidence = min_confidence
+        self.phrase_targets = {
+            phrase: target for phrase, target in TARGET_PHRASES.items()
+            if (target[0] in field_to_messages if target[1] == "field" else target[0] in message_definitions)
+        }
+        self.phrase_patterns = [(re.compile(r"\b" + re.escape(phrase) + r"s?\b"), target)  # plurals too
+                                for phrase, target in self.phrase_targets.items()]
+
+    def classify(self, query):
+        """Return ``{intent, target, target_type, confidence[, query_time_us][, top_k]}`` or None when unsure."""
+        text = query.lower()
+
+        query_time_us = self.query_time(text)
+        if query_time_us is False:
+            return None  # a time we cannot use (wall-clock, several quantities, unknown unit)
+        intents = self.intents(text)
+        if query_time_us is not None:
+            intents["value_at_time"] = "timestamp"
+        if len(intents) != 1:
+            return None
+        intent, intent_source = next(iter(intents.items()))
+
+        target, target_source = self.target(query, text, intent)
+        if target is None:
+            return None
+        if intent == "time_duration" and (target_source != "default" or self.names_state(query, text)):
+            return None
+
+        confidence = INTENT_CONFIDENCE[intent_source] * TARGET_CONFIDENCE[target_source]
+        if confidence < self.min_confidence:
+            return None
+
+        result = {"intent": intent, "target": target[0], "target_type": target[1], "confidence": confidence}
+        if query_time_us is not None:
+            result["query_time_us"] = query_time_us
+        if intent in ("max_value", "min_value"):
+            top_k = TOP_K.search(text)
+            if top_k:
+                result["top_k"] = int(top_k.group(1) or top_k.group(3))
+        return result
+
+    @staticmethod
+    def intents(text):
+        """Every intent the query's keywords point at, mapped to how it was found."""
+        intents = {intent: "keyword" for intent, pattern in INTENT_RULES if pattern.search(text)}
+        if not intents and WEAK_EVENT.search(text):
+            intents["event_detection"] = "weak"
+        return intents
+
+    @staticmethod
+    def query_time(text):
+        """Microseconds for "at 10 seconds" / "at timestamp 70000000"; None if absent, False if unusable."""
+        if CLOCK_TIME.search(text):
+            return False
+        match = AT_TIME.search(text)
+        if not match:
+            # "in the first 10 seconds" limits the time range, which the fast path cannot express
+            return False if TIME_QUANTITY.search(text) else None
+        if len(NUMBER.findall(text)) > 1:
+            return False  # "at 10 minutes and 30 seconds", or a time next to another quantity
+        value, unit = float(match.group(1)), match.group(2)
+        if unit in TIME_UNITS_US:
+            return int(value * TIME_UNITS_US[unit])
+        if unit is None and value >= MIN_BARE_TIMESTAMP_US:
+            return int(value)
+        return False  # an unknown unit ("at 150000 feet"), or a number too small to be a timestamp
+
+    @staticmethod
+    def names_state(query, text):
+        """Whether a duration question names a state, value or condition rather than the whole flight."""
+        if DURATION_CONDITION.search(text):
+            return True
+        # An all-caps word that is not a vehicle is a state value ("AUTO", "LOITER", "RTL")
+        return any(word.isupper() and len(word) > 1 and word.lower() not in VEHICLE_WORDS
+                   for word in IDENTIFIER.findall(query))
+
+    def target(self, query, text, intent):
+        """The single target the query names, and how it was found; ``(None, None)`` if none or several."""
+        if intent == "event_detection" and LOSS_WORDS.search(text) and "err" in self.message_definitions:
+            return ("err", "message"), "loss"
+
+        # Keep only matches not inside a longer one ("gps speed" hides "gps" and "speed")
+        matches = [(m.start(), m.end(), target) for pattern, target in self.phrase_patterns
+                   for m in pattern.finditer(text)]
+        kept = [
+            (start, target) for start, end, target in matches
+            if not any(s <= start and end <= e and (e - s) > (end - start) for s, e, _ in matches)
+        ]
+        for start, _ in kept:
+            lead = PRECEDING_WORD.search(text, 0, start)
+            if lead and lead.group(1) not in PHRASE_LEAD_WORDS and not lead.group(1).isdigit():
+                return None, None  # "vertical speed", "motor temperature": a source the table does not know
+        targets = {target for _, target in kept}
+        if targets:
+            return (targets.pop(), "phrase") if len(targets) == 1 else (None, None)
+
+        # ArduPilot names written as identifiers are taken literally: all caps is a
+        # message ("ERR", "VIBE"), mixed case is a field ("NSats", "TimeUS")
+        targets = set()
+        for word in IDENTIFIER.findall(query):
+            name = word.lower()
+            if word.isupper() and len(word) > 1 and name in self.message_definitions:
+                targets.add((name, "message"))
+            elif not word.isupper() and word[1:] != word[1:].lower() and name in self.field_to_messages:
+                targets.add((name, "field"))
+        if targets:
+            return (targets.pop(), "identifier") if len(targets) == 1 else (None, None)
+
+        if intent == "time_duration":
+            return ("timeus", "field"), "default"  # flight-length questions, as in the LLM prompt's example
+        return None, None
@@ -0,0 +1,256 @@
+import re
+import json
+import numpy as np
+from dataset import DatasetBuilder, LogDataset, TIME_FIELD, to_column, to_python
+
+
+class InvalidChunk(ValueError):
+    """A malformed NDJSON chunk in an upload; ``line_number`` is its 1-based line."""
+
+    def __init__(self, line_number, reason):
+        super().__init__(f"Invalid chunk on line {line_number}: {reason}")
+        self.line_number = line_number
+
+
+def normalize_message_type(key):
+    return re.sub(r'\[\d+\]$', '', key).lower()
+
+
+def normalize_field(field, column):
+    """Lower-case a field name and convert ``time_boot_ms`` to ``timeus`` in one vectorized pass."""
+    field_name = field.lower()
+    if field_name == "time_boot_ms":
+        # Widen before scaling: uint32 milliseconds wrap after ~71.6 minutes once multiplied by 1000
+        if column.dtype.kind == "f":
+            column = column.astype(np.float64, copy=False)
+        elif column.dtype.kind in "biu":
+            column = column.astype(np.int64, copy=False)
+        return TIME_FIELD, column * 1000  # Convert milliseconds to microseconds
+    return field_name, column
+
+
+def pad_column(column, length):
+    """Pad a short column to ``length`` rows, marking the missing rows as NaN / None."""
+    missing = length - len(column)
+    if missing <= 0:
+        return column
+    if column.dtype == object:
+        return np.concatenate([column, np.full(missing, None, dtype=object)])
+    return np.concatenate([column.astype(np.float64, copy=False), np.full(missing, np.nan)])
+
+
+def field_arrays_to_columns(message_data):
+    """
+    Convert one message in field-array format (``{field: [v0, v1, ...]}``)
+    into ``{field: ndarray}`` without building per-row dicts.
+    """
+    length = max((len(v) for v in message_data.values() if isinstance(v, list)), default=0)
+    columns = {}
+    for field, values in message_data.items():
+        if not isinstance(values, list):
+            values = [values] * length  # broadcast per-message constants
+        field_name, column = normalize_field(field, to_column(values))
+        columns[field_name] = pad_column(column, length)
+    return columns
+
+
+def rows_to_columns(rows):
+    """Convert a list of row dicts into ``{field: ndarray}`` (legacy row format)."""
+    field_names = {}
+    for row in rows:
+        if isinstance(row, dict):
+            for key in row:
+                field_names.setdefault(key, None)
+
+    columns = {}
+    for field in field_names:
+        values = [row.get(field) if isinstance(row, dict) else None for row in rows]
+        field_name, column = normalize_field(field, to_column(values))
+        columns[field_name] = column
+    return columns
+
+
+def message_to_columns(message_data):
+    """Convert one frontend message (field arrays, a single row, or a row list) to columns."""
+    if isinstance(message_data, dict):
+        if any(isinstance(v, list) for v in message_data.values()):
+            return field_arrays_to_columns(message_data)
+        # Treat as single-row dict of scalar values
+        return field_arrays_to_columns({field: [value] for field, value in message_data.items()})
+
+    if isinstance(message_data, list):
+        # Likely already list of dicts
+        return rows_to_columns(message_data)
+
+    return None
+
+
+def dataset_from_frontend(frontend_data):
+    """Build a LogDataset from the JSON payload posted to /api/parser."""
+    messages = frontend_data.get('messages')
+    if messages is None:
+        # Already in backend format: {msg_type: [row, ...]}
+        messages = frontend_data
+
+    dataset = LogDataset()
+    for original_key, message_data in messages.items():
+        msg_type = normalize_message_type(original_key)
+        columns = message_to_columns(message_data)
+        if columns is None:
+            print(f"[Warning] Unexpected format for message '{msg_type}': {type(message_data)} — skipped.")
+            columns = {}
+        dataset.add_message(msg_type, columns)
+
+    return dataset
+
+
+def ingest_ndjson_stream(stream, total_bytes=None, progress=None):
+    """
+    Build a LogDataset from an NDJSON upload, one message chunk per line:
+
+        {"message": "ATTITUDE", "fields": {"time_boot_ms": [...], "roll": [...]}}
+
+    Lines are decoded and converted one at a time and appended to the store,
+    so peak memory is bounded by the chunk size plus the column data.
+
+    Args:
+        stream: Binary file-like object yielding lines (e.g. ``request.stream``)
+        total_bytes (int, optional): Expected body size, used for progress
+        progress (callable, optional): Called as ``progress(chunks, bytes_read, total_bytes)``
+
+    Returns:
+        tuple: (LogDataset, stats dict with chunk/byte totals and per-message row counts)
+    """
+    builder = DatasetBuilder()
+    bytes_read = 0
+    chunk_count = 0
+
+    for line_number, line in enumerate(stream, 1):
+        bytes_read += len(line)
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            chunk = json.loads(line)
+            msg_type = normalize_message_type(chunk["message"])
+            columns = message_to_columns(chunk["fields"])
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise InvalidChunk(line_number, e)
+        if columns is None:
+            raise InvalidChunk(line_number, f"unexpected fields format for '{msg_type}'")
+
+        builder.append(msg_type, columns)
+        chunk_count += 1
+        if progress:
+            progress(chunk_count, bytes_read, total_bytes)
+
+    row_counts = dict(builder.row_counts)
+    dataset = builder.build()
+
+    return dataset, {
+        "chunks": chunk_count,
+        "bytes_received": bytes_read,
+        "row_counts": row_counts
+    }
+
+
+# --- Binary typed-array container ---------------------------------------------
+#
+# Layout (all integers little-endian):
+#
+#   b"UAVB" | uint32 header length | JSON header | zero padding to 8 bytes | data
+#
+# The header is {"messages": {name: {"fields": {field: spec}}}} where a
+# numeric spec is {"dtype": "float64", "offset": <bytes into data>, "count": n}
+# and a non-numeric field is sent inline as {"values": [...]}.
+
+BINARY_MAGIC = b"UAVB"
+BINARY_ALIGNMENT = 8
+BINARY_DTYPES = {
+    "int8", "uint8", "int16", "uint16", "int32", "uint32",
+    "int64", "uint64", "float32", "float64"
+}
+
+
+def _align(offset):
+    return -(-offset // BINARY_ALIGNMENT) * BINARY_ALIGNMENT
+
+
+def encode_binary_container(messages):
+    """
+    Encode ``{msg_type: {field: values}}`` into the binary upload container.
+
+    Returns:
+        bytes: Payload suitable for POSTing to /api/parser as application/octet-stream
+    """
+    header = {"messages": {}}
+    buffers = []
+    offset = 0
+
+    for msg_type, fields in messages.items():
+        specs = {}
+        for field, values in fields.items():
+            column = to_column(values)
+            if column.dtype == object:
+                specs[field] = {"values": [to_python(v) for v in column]}
+                continue
+            if column.dtype.kind == "b":
+                column = column.astype(np.uint8)
+
+            column = np.ascontiguousarray(column, dtype=column.dtype.newbyteorder("<"))
+            offset = _align(offset)
+            specs[field] = {"dtype": column.dtype.name, "offset": offset, "count": len(column)}
+            buffers.append((offset, column))
+            offset += column.nbytes
+        header["messages"][msg_type] = {"fields": specs}
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _align(8 + len(header_bytes))
+    payload = bytearray(data_start + offset)
+    payload[0:4] = BINARY_MAGIC
+    payload[4:8] = len(header_bytes).to_bytes(4, "little")
+    payload[8:8 + len(header_bytes)] = header_bytes
+    for buffer_offset, column in buffers:
+        start = data_start + buffer_offset
+        payload[start:start + column.nbytes] = column.tobytes()
+
+    return bytes(payload)
+
+
+def dataset_from_binary(body):
+    """
+    Build a LogDataset from a binary upload container.
+
+    Numeric columns are wrapped in place with ``np.frombuffer`` (no copy), so
+    the returned dataset keeps a reference to ``body``.
+    """
+    view = memoryview(body)
+    if len(view) < 8 or bytes(view[:4]) != BINARY_MAGIC:
+        raise ValueError("Not a binary parser container (bad magic)")
+
+    header_length = int.from_bytes(view[4:8], "little")
+    header = json.loads(bytes(view[8:8 + header_length]))
+    data_start = _align(8 + header_length)
+
+    dataset = LogDataset()
+    for original_key, message in header.get("messages", {}).items():
+        msg_type = normalize_message_type(original_key)
+        columns = {}
+        for field, spec in message.get("fields", {}).items():
+            if "values" in spec:
+                column = to_column(spec["values"])
+            else:
+                if spec.get("dtype") not in BINARY_DTYPES:
+                    raise ValueError(f"Unsupported dtype '{spec.get('dtype')}' for {msg_type}.{field}")
+                dtype = np.dtype(spec["dtype"]).newbyteorder("<")
+                count = int(spec["count"])
+                start = data_start + int(spec["offset"])
+                if start + count * dtype.itemsize > len(view):
+                    raise ValueError(f"Buffer for {msg_type}.{field} runs past the end of the payload")
+                column = np.frombuffer(view, dtype=dtype, count=count, offset=start)
+            field_name, column = normalize_field(field, column)
+            columns[field_name] = column
+        dataset.add_message(msg_type, columns)
+
+    return dataset
@@ -0,0 +1,151 @@
+import numpy as np
+from dataset import LogDataset, heap_nbytes, to_python
+
+
+class ThresholdSeries:
+    """
+    A numeric field in time order, for threshold questions.
+
+    Each sample holds its value until the next sample (the last one has no
+    duration), so the time spent above a threshold is the summed hold time
+    of the samples above it. Missing samples never satisfy a condition.
+
+    Single conditions are answered with one vectorized pass over the series.
+    Threshold sweeps use a value-sorted copy built on first use, after which
+    every threshold is a ``searchsorted`` lookup.
+    """
+
+    def __init__(self, times, values):
+        self.times = times
+        self.values = values
+        self.durations = np.diff(times, append=times[-1:]) if len(times) else np.zeros(0, dtype=times.dtype)
+        self.sweeps = {}
+
+    @classmethod
+    def from_dataset(cls, dataset: LogDataset, msg_type, field):
+        """Build the series from the message's time index, or return None if the field is not numeric."""
+        series = dataset.time_series(msg_type, field)
+        return None if series is None else cls(*series)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def nbytes(self):
+        """Bytes of the values, hold durations and any sweep tables built so far (times are the dataset's)."""
+        return heap_nbytes(self.values, self.durations) + sum(
+            heap_nbytes(*sweep) for sweep in list(self.sweeps.values())
+        )
+
+    def mask(self, above=None, below=None):
+        """Samples with ``above < value < below`` (either bound may be omitted)."""
+        mask = ~np.isnan(self.values)
+        if above is not None:
+            mask &= self.values > above
+        if below is not None:
+            mask &= self.values < below
+        return mask
+
+    def intervals(self, mask):
+        """Contiguous ``(start_times, end_times)`` where ``mask`` holds; an interval ends at the first sample outside it."""
+        edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.minimum(np.flatnonzero(edges == -1), len(self.times) - 1)
+        return self.times[starts], self.times[ends]
+
+    def evaluate(self, above=None, below=None):
+        """Intervals, total duration and crossing count for one condition."""
+        mask = self.mask(above, below)
+        start_times, end_times = self.intervals(mask)
+        return {
+            "start_times": start_times,
+            "end_times": end_times,
+            "total_duration": self.durations[mask].sum(),
+            "crossings": int(np.count_nonzero(mask[1:] != mask[:-1]))
+        }
+
+    def _sweep(self, direction):
+        """Value-sorted hold times and sorted pair bounds, cached per direction."""
+        if direction not in self.sweeps:
+            # "below t" is "above -t" on the negated values
+            values = self.values if direction == "above" else -self.values
+            present = ~np.isnan(values)
+            order = np.argsort(values[present], kind="stable")
+            cumulative = np.concatenate([[0], np.cumsum(self.durations[present][order])])
+
+            # A pair of consecutive samples crosses t when low <= t < high (missing = never above)
+            filled = np.where(present, values, -np.inf)
+            lows = np.sort(np.minimum(filled[:-1], filled[1:]))
+            highs = np.sort(np.maximum(filled[:-1], filled[1:]))
+            self.sweeps[direction] = (values[present][order], cumulative, lows, highs)
+        return self.sweeps[direction]
+
+    def duration_curve(self, thresholds, direction="above"):
+        """Total duration and crossing count for every threshold, as two arrays."""
+        sorted_values, cumulative, lows, highs = self._sweep(direction)
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        if direction != "above":
+            thresholds = -thresholds
+        below_or_at = np.searchsorted(sorted_values, thresholds, side="right")
+        durations = cumulative[-1] - cumulative[below_or_at]
+        crossings = np.searchsorted(lows, thresholds, side="right") - np.searchsorted(highs, thresholds, side="right")
+        return durations, crossings
+
+
+def threshold_series(dataset: LogDataset, msg_type, field):
+    """Return the cached ``ThresholdSeries`` of a field, or None if it has no numeric time series."""
+    return dataset.derived(msg_type, field, "threshold_series",
+                           lambda: ThresholdSeries.from_dataset(dataset, msg_type, field))
+
+
+def threshold_intervals(dataset: LogDataset, field, message_types, above=None, below=None, max_intervals=20):
+    """
+    Time intervals where ``field`` is above, below or between thresholds.
+
+    Args:
+        dataset (LogDataset): Parsed log
+        field (str): Numeric field to test
+        message_types (list): Messages to search
+        above (float, optional): Lower bound (exclusive)
+        below (float, optional): Upper bound (exclusive)
+        max_intervals (int): Intervals returned per message; totals always cover all of them
+
+    Returns:
+        list: Per-message intervals plus total duration, interval and crossing counts
+    """
+    results = []
+    for msg in message_types:
+        series = threshold_series(dataset, msg, field)
+        if series is None or not len(series):
+            continue
+        result = series.evaluate(above, below)
+        intervals = [
+            {"start_time": to_python(start), "end_time": to_python(end), "duration": to_python(end - start)}
+            for start, end in zip(result["start_times"][:max_intervals], result["end_times"][:max_intervals])
+        ]
+        results.append({
+            "message_type": msg,
+            "total_duration": to_python(result["total_duration"]),
+            "interval_count": len(result["start_times"]),
+            "crossings": result["crossings"],
+            "intervals": intervals
+        })
+    return results
+
+
+def duration_curve(dataset: LogDataset, field, message_types, thresholds, direction="above"):
+    """Total time above (or below) each threshold and the number of crossings, summed over messages."""
+    durations = crossings = None
+    for msg in message_types:
+        series = threshold_series(dataset, msg, field)
+        if series is None or not len(series):
+            continue
+        msg_durations, msg_crossings = series.duration_curve(thresholds, direction)
+        durations = msg_durations if durations is None else durations + msg_durations
+        crossings = msg_crossings if crossings is None else crossings + msg_crossings
+    if durations is None:
+        return None
+    return [
+        {"threshold": to_python(threshold), "duration": to_python(duration), "crossings": to_python(count)}
+        for threshold, duration, count in zip(thresholds, durations, crossings)
+    ]
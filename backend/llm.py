@@ -0,0 +1,206 @@
+"""
+Chat-completion backends shared by Stage 1 and Stage 3.
+
+Both stages only need the reply text of a chat completion, so a backend is
+anything with ``complete(model, messages, **kwargs)`` and an awaitable
+``complete_async`` returning that text. ``LLM_BACKEND`` selects one:
+
+- ``openai``: the OpenAI API over pooled HTTP connections (default)
+- ``stub``: deterministic local replies after ``LLM_STUB_LATENCY_MS``, no network
+- ``record``: the OpenAI API, with every reply saved to the ``LLM_CASSETTE`` file
+- ``replay``: replies served from ``LLM_CASSETTE``; an unrecorded request is an error
+
+Stages register the stub reply for their model with ``register_stub``.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv('secret.env')
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", 0))
+LLM_CASSETTE = os.getenv("LLM_CASSETTE", "llm_cassette.json")
+# Replay sleeps for each reply's recorded latency, so timings resemble the recording
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "0") == "1"
+
+# model -> function(messages) returning the stub reply text
+stub_replies = {}
+
+
+def register_stub(model, reply):
+    """Use ``reply(messages)`` as the stub backend's answer for ``model``."""
+    stub_replies[model] = reply
+
+
+def default_stub_reply(messages):
+    return json.dumps({"final_answer": f"Stub reply to {len(messages)} messages."})
+
+
+class LLMBackend:
+    """Base class: ``complete_async`` defaults to running ``complete`` on a thread."""
+
+    name = "base"
+
+    def complete(self, model, messages, **kwargs):
+        raise NotImplementedError
+
+    async def complete_async(self, model, messages, **kwargs):
+        return await asyncio.to_thread(self.complete, model, messages, **kwargs)
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    The OpenAI chat completions API.
+
+    One sync and one async client are created per process and reused, each
+    keeping up to ``max_connections`` pooled keep-alive connections, so
+    concurrent requests do not pay a TLS handshake each.
+    ``OPENAI_BASE_URL`` points both at another server (e.g. ``stub_server.py``).
+    """
+
+    name = "openai"
+
+    def __init__(self, api_key=None, max_connections=LLM_MAX_CONNECTIONS):
+        # Imported here so the stub and replay backends work without the OpenAI SDK
+        import httpx
+        import openai
+
+        api_key = api_key or os.getenv('OPENAI_API_KEY')
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY not found in environment variables")
+
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.client = openai.OpenAI(api_key=api_key, http_client=openai.DefaultHttpxClient(limits=limits))
+        self.async_client = openai.AsyncOpenAI(
+            api_key=api_key, http_client=openai.DefaultAsyncHttpxClient(limits=limits)
+        )
+
+    def complete(self, model, messages, **kwargs):
+        response = self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+        return response.choices[0].message.content
+
+    async def complete_async(self, model, messages, **kwargs):
+        response = await self.async_client.chat.completions.create(model=model, messages=messages, **kwargs)
+        return response.choices[0].message.content
+
+
+class StubBackend(LLMBackend):
+    """
+    Deterministic local replies: the same request always gets the same answer
+    after ``latency_s``. Replies come from ``register_stub`` for the model,
+    so the pipeline runs end to end offline.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency_s=LLM_STUB_LATENCY_MS / 1e3):
+        self.latency_s = latency_s
+
+    def reply(self, model, messages):
+        return stub_replies.get(model, default_stub_reply)(messages)
+
+    def complete(self, model, messages, **kwargs):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return self.reply(model, messages)
+
+    async def complete_async(self, model, messages, **kwargs):
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        return self.reply(model, messages)
+
+
+class CassetteMiss(LookupError):
+    """A replayed request that was never recorded."""
+
+
+class CassetteBackend(LLMBackend):
+    """
+    Record/replay of another backend's replies.
+
+    Requests are keyed by a hash of the model, messages and completion
+    arguments. With ``record=True`` every reply of ``inner`` is saved to the
+    JSON file at ``path``; otherwise replies are served from that file and a
+    request missing from it raises ``CassetteMiss``. The name is the inner
+    backend's, since replayed replies are that backend's answers.
+    """
+
+    def __init__(self, path=LLM_CASSETTE, inner=None, record=False, replay_latency=LLM_REPLAY_LATENCY):
+        self.path = path
+        self.inner = inner
+        self.record = record
+        self.replay_latency = replay_latency
+        self.name = inner.name if inner is not None else "openai"
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+        elif not record:
+            raise FileNotFoundError(f"LLM cassette not found: {path}")
+
+    @staticmethod
+    def key(model, messages, kwargs):
+        request = json.dumps({"model": model, "messages": messages, "kwargs": kwargs},
+                             sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def lookup(self, key, model):
+        entry = self.entries.get(key)
+        if entry is None:
+            raise CassetteMiss(f"No recorded {model} reply for request {key[:12]} in {self.path}")
+        return entry
+
+    def save(self, key, model, reply, latency_s):
+        with self.lock:
+            self.entries[key] = {"model": model, "reply": reply, "latency_s": round(latency_s, 4)}
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        return reply
+
+    def complete(self, model, messages, **kwargs):
+        key = self.key(model, messages, kwargs)
+        if self.record:
+            start = time.perf_counter()
+            reply = self.inner.complete(model, messages, **kwargs)
+            return self.save(key, model, reply, time.perf_counter() - start)
+        entry = self.lookup(key, model)
+        if self.replay_latency:
+            time.sleep(entry["latency_s"])
+        return entry["reply"]
+
+    async def complete_async(self, model, messages, **kwargs):
+        key = self.key(model, messages, kwargs)
+        if self.record:
+            start = time.perf_counter()
+            reply = await self.inner.complete_async(model, messages, **kwargs)
+            return self.save(key, model, reply, time.perf_counter() - start)
+        entry = self.lookup(key, model)
+        if self.replay_latency:
+            await asyncio.sleep(entry["latency_s"])
+        return entry["reply"]
+
+
+def make_backend(kind=LLM_BACKEND):
+    """Build the backend named by ``LLM_BACKEND``."""
+    if kind == "openai":
+        return OpenAIBackend()
+    if kind == "stub":
+        return StubBackend()
+    if kind == "record":
+        return CassetteBackend(inner=OpenAIBackend(), record=True)
+    if kind == "replay":
+        return CassetteBackend()
+    raise ValueError(f"Unknown LLM_BACKEND: {kind!r} (expected openai, stub, record or replay)")
+
+
+# The process-wide backend used by both stages
+backend = make_backend()
@@ -0,0 +1,218 @@
+import numpy as np
+from dataset import LogDataset, heap_nbytes, to_python
+
+# Finest pyramid level: buckets of 2**BASE_LEVEL samples. Ranges shorter than
+# the budget are served raw, so finer levels would only cost memory.
+BASE_LEVEL = 4
+METHODS = {"minmax", "mean", "lttb"}
+
+
+class LodLevel:
+    """Per-bucket extremes and sums for one power-of-two bucket size."""
+
+    def __init__(self, size, min_pos, max_pos, sums, counts):
+        self.size = size
+        self.min_pos = min_pos  # series position of each bucket's minimum (-1 if empty)
+        self.max_pos = max_pos
+        self.sums = sums
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def nbytes(self):
+        return heap_nbytes(self.min_pos, self.max_pos, self.sums, self.counts)
+
+
+class LodPyramid:
+    """
+    Min/max/mean level-of-detail pyramid over one time-ordered numeric series.
+
+    Level ``k`` summarizes buckets of ``2**(BASE_LEVEL + k)`` samples, each
+    built from pairs of buckets of the level below, so the whole pyramid costs
+    O(n) to build and about n / 2**BASE_LEVEL buckets to hold. A range is
+    served from the level whose bucket count fits the point budget, so the
+    cost of a request depends on the budget, not on the length of the log,
+    and every bucket keeps its real minimum and maximum sample.
+    """
+
+    def __init__(self, times, values):
+        self.times = times
+        self.values = values
+        self.levels = []
+        if len(values):
+            level = self._base_level(values, 2 ** BASE_LEVEL)
+            self.levels.append(level)
+            while len(level) > 1:
+                level = self._merge_level(level)
+                self.levels.append(level)
+
+    @staticmethod
+    def _base_level(values, size):
+        buckets = -(-len(values) // size)
+        padded = np.full(buckets * size, np.nan)
+        padded[:len(values)] = values
+        blocks = padded.reshape(buckets, size)
+
+        present = ~np.isnan(blocks)
+        counts = present.sum(axis=1)
+        offsets = np.arange(buckets) * size
+        min_pos = offsets + np.where(present, blocks, np.inf).argmin(axis=1)
+        max_pos = offsets + np.where(present, blocks, -np.inf).argmax(axis=1)
+        empty = counts == 0
+        min_pos[empty] = max_pos[empty] = -1
+        return LodLevel(size, min_pos, max_pos, np.where(present, blocks, 0.0).sum(axis=1), counts)
+
+    def _merge_level(self, level):
+        min_pos, max_pos, sums, counts = level.min_pos, level.max_pos, level.sums, level.counts
+        if len(level) % 2:
+            min_pos, max_pos = np.append(min_pos, -1), np.append(max_pos, -1)
+            sums, counts = np.append(sums, 0.0), np.append(counts, 0)
+
+        def pick(positions, fill, better):
+            first, second = positions[0::2], positions[1::2]
+            first_values = np.where(first >= 0, self.values[first], fill)
+            second_values = np.where(second >= 0, self.values[second], fill)
+            return np.where(better(second_values, first_values), second, first)
+
+        return LodLevel(
+            level.size * 2,
+            pick(min_pos, np.inf, np.less),
+            pick(max_pos, -np.inf, np.greater),
+            sums[0::2] + sums[1::2],
+            counts[0::2] + counts[1::2]
+        )
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def nbytes(self):
+        """Bytes of the levels and the float64 values (the times belong to the dataset's ``TimeIndex``)."""
+        return heap_nbytes(self.values) + sum(level.nbytes for level in self.levels)
+
+    def _level_for(self, samples, buckets):
+        """Finest level that covers ``samples`` in at most ``buckets`` buckets."""
+        for level in self.levels:
+            if samples / level.size <= buckets:
+                return level
+        return self.levels[-1]
+
+    def range(self, start_time=None, end_time=None):
+        lo = 0 if start_time is None else int(np.searchsorted(self.times, start_time, side="left"))
+        hi = len(self.times) if end_time is None else int(np.searchsorted(self.times, end_time, side="right"))
+        return lo, max(lo, hi)
+
+    def minmax(self, budget, start_time=None, end_time=None):
+        """
+        Series positions of at most about ``budget`` points, in time order,
+        that include the minimum and maximum of every bucket in the range.
+        """
+        lo, hi = self.range(start_time, end_time)
+        present = np.flatnonzero(~np.isnan(self.values[lo:hi])) + lo if hi - lo <= budget else None
+        if present is not None:
+            return present
+
+        level = self._level_for(hi - lo, max(1, budget // 2))
+        first, last = lo // level.size, (hi - 1) // level.size
+        positions = np.concatenate([level.min_pos[first:last + 1], level.max_pos[first:last + 1]])
+
+        # The edge buckets may reach outside the range; rescan their in-range part directly
+        positions = positions[(positions >= lo) & (positions < hi)]
+        for edge_lo, edge_hi in [(lo, min(hi, (first + 1) * level.size)), (max(lo, last * level.size), hi)]:
+            edge = self.values[edge_lo:edge_hi]
+            if len(edge) and not np.isnan(edge).all():
+                positions = np.append(positions, [edge_lo + np.nanargmin(edge), edge_lo + np.nanargmax(edge)])
+        return np.unique(positions)
+
+    def means(self, budget, start_time=None, end_time=None):
+        """``(times, means)`` of at most about ``budget`` buckets covering the range (bucket start time)."""
+        lo, hi = self.range(start_time, end_time)
+        if hi - lo <= budget:
+            present = np.flatnonzero(~np.isnan(self.values[lo:hi])) + lo
+            return self.times[present], self.values[present]
+
+        level = self._level_for(hi - lo, budget)
+        first, last = lo // level.size, (hi - 1) // level.size
+        counts = level.counts[first:last + 1]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = level.sums[first:last + 1] / counts
+        starts = np.maximum(np.arange(first, last + 1) * level.size, lo)
+        keep = counts > 0
+        return self.times[starts[keep]], means[keep]
+
+    def lttb(self, budget, start_time=None, end_time=None):
+        """Largest-Triangle-Three-Buckets selection of ``budget`` points from the min/max candidates."""
+        candidates = self.minmax(4 * budget, start_time, end_time)
+        if len(candidates) <= budget or budget < 3:
+            return candidates[:max(budget, 0)] if budget < 3 else candidates
+
+        x = self.times[candidates].astype(np.float64)
+        y = self.values[candidates]
+        edges = np.linspace(1, len(candidates) - 1, budget - 1).astype(int)
+
+        selected = [0]
+        for b in range(budget - 2):
+            bucket = np.arange(edges[b], max(edges[b] + 1, edges[b + 1]))
+            following = np.arange(edges[b + 1], max(edges[b + 1] + 1, edges[b + 2] if b + 2 < len(edges) else len(candidates)))
+            avg_x, avg_y = x[following].mean(), y[following].mean()
+            prev = selected[-1]
+            areas = np.abs((x[prev] - avg_x) * (y[bucket] - y[prev]) - (x[prev] - x[bucket]) * (avg_y - y[prev]))
+            selected.append(int(bucket[np.argmax(areas)]))
+        selected.append(len(candidates) - 1)
+        return candidates[np.array(selected)]
+
+
+def lod_pyramid(dataset: LogDataset, msg_type, field):
+    """Return the cached ``LodPyramid`` of a numeric field (built on first use), or None."""
+    def build():
+        series = dataset.time_series(msg_type, field)
+        return None if series is None else LodPyramid(*series)
+
+    return dataset.derived(msg_type, field, "lod", build)
+
+
+def downsample(dataset: LogDataset, field, message_types, budget, start_time=None, end_time=None, method="minmax"):
+    """
+    Points of ``field`` within a time range, reduced to a point budget shared across messages.
+
+    Returns:
+        list: ``{"time", "value", "message_type"}`` dicts in time order per message
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown resampling method '{method}', expected one of {sorted(METHODS)}")
+
+    pyramids = [(msg, lod_pyramid(dataset, msg, field)) for msg in message_types]
+    pyramids = [(msg, pyramid) for msg, pyramid in pyramids if pyramid is not None and len(pyramid)]
+    if not pyramids:
+        return []
+
+    per_message = max(2, budget // len(pyramids))
+    points = []
+    for msg, pyramid in pyramids:
+        if method == "mean":
+            times, values = pyramid.means(per_message, start_time, end_time)
+        else:
+            select = pyramid.lttb if method == "lttb" else pyramid.minmax
+            positions = select(per_message, start_time, end_time)
+            times, values = pyramid.times[positions], pyramid.values[positions]
+        points.extend(
+            {"time": to_python(t), "value": to_python(v), "message_type": msg}
+            for t, v in zip(times, values)
+        )
+    return points
+
+
+def bucket_extremes(magnitudes, budget):
+    """
+    Pick ``budget`` items spread evenly over a sequence, taking the one with the
+    largest magnitude from each equal-count bucket instead of a fixed stride.
+    """
+    total = len(magnitudes)
+    if total <= budget:
+        return np.arange(total)
+    buckets = np.minimum(np.arange(total) * budget // total, budget - 1)
+    order = np.lexsort((-np.nan_to_num(magnitudes, nan=-np.inf), buckets))
+    _, first = np.unique(buckets[order], return_index=True)
+    return np.sort(order[first])
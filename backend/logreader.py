@@ -0,0 +1,270 @@
+import mmap
+import os
+import struct
+import time
+from array import array
+import numpy as np
+from pymavlink import mavutil
+from dataset import DatasetBuilder, to_column
+from ingest import normalize_field
+
+SKIPPED_MESSAGE_TYPES = {"BAD_DATA"}
+DATAFLASH_EXTENSIONS = {".bin", ".log"}
+
+# DataFlash record framing: two signature bytes and the message type id
+DF_HEADER = b"\xa3\x95"
+DF_FMT_TYPE = 0x80
+DF_FMT_LENGTH = 89
+DF_FMT_STRUCT = struct.Struct("<BB4s16s64s")
+
+# DataFlash format character -> (NumPy dtype, divisor applied to the raw value)
+# Mirrors pymavlink's DFReader.FORMAT_TO_STRUCT with multipliers applied.
+DF_FORMATS = {
+    "a": (("<i2", (32,)), None),
+    "b": ("i1", None),
+    "B": ("u1", None),
+    "g": ("<f2", None),
+    "h": ("<i2", None),
+    "H": ("<u2", None),
+    "i": ("<i4", None),
+    "I": ("<u4", None),
+    "f": ("<f4", None),
+    "n": ("S4", None),
+    "N": ("S16", None),
+    "Z": ("S64", None),
+    "c": ("<i2", 100.0),
+    "C": ("<u2", 100.0),
+    "e": ("<i4", 100.0),
+    "E": ("<u4", 100.0),
+    "L": ("<i4", 1.0e7),
+    "d": ("<f8", None),
+    "M": ("i1", None),
+    "q": ("<i8", None),
+    "Q": ("<u8", None),
+}
+
+
+def read_log(path, batch_size=65536, progress=None):
+    """
+    Read a DataFlash ``.bin`` or MAVLink ``.tlog`` file straight into a LogDataset.
+
+    Args:
+        path (str): Path to the log file
+        batch_size (int): Records converted per message type before flushing to the column buffers
+        progress (callable, optional): Called as ``progress(records_read)`` after each flush
+
+    Returns:
+        tuple: (LogDataset, stats dict with record count, elapsed time and rows per message type)
+    """
+    start = time.perf_counter()
+    builder = DatasetBuilder()
+
+    if os.path.splitext(path)[1].lower() in DATAFLASH_EXTENSIONS:
+        records = read_dataflash(path, builder, batch_size, progress)
+    else:
+        records = read_mavlink(path, builder, min(batch_size, 4096), progress)
+
+    elapsed = time.perf_counter() - start
+    return builder.build(), {
+        "records": records,
+        "elapsed_s": elapsed,
+        "records_per_s": records / elapsed if elapsed else 0.0,
+        "row_counts": dict(builder.row_counts)
+    }
+
+
+# --- DataFlash (.bin) ---------------------------------------------------------
+
+
+class DataFlashFormat:
+    """One FMT definition plus the offsets of every record that uses it (an int64 ``array``, 8 bytes each)."""
+
+    def __init__(self, name, length, format_chars, columns):
+        self.name = name
+        self.length = length
+        self.format_chars = format_chars
+        self.columns = columns
+        self.offsets = array("q")
+
+        fields = list(zip(columns, format_chars))
+        self.dtype = np.dtype({
+            "names": [f"f{i}" for i in range(len(fields))],
+            "formats": [DF_FORMATS[char][0] for _, char in fields],
+        })
+
+    def same_definition(self, other):
+        return (self.name, self.length, self.format_chars, self.columns) == \
+               (other.name, other.length, other.format_chars, other.columns)
+
+
+def _null_term(raw):
+    return raw.split(b"\0", 1)[0]
+
+
+def _decode_string(raw):
+    raw = _null_term(raw)
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("ISO-8859-1")
+
+
+def _decode_strings(values):
+    """Decode a fixed-width bytes column once per distinct value."""
+    unique, inverse = np.unique(values, return_inverse=True)
+    decoded = np.empty(len(unique), dtype=object)
+    decoded[:] = [_decode_string(v) for v in unique.tolist()]
+    return decoded[inverse.ravel()]
+
+
+def _parse_fmt(body):
+    msg_type, length, name, format_chars, columns = DF_FMT_STRUCT.unpack(body)
+    columns = _decode_string(columns)
+    return msg_type, DataFlashFormat(
+        _decode_string(name),
+        length,
+        _decode_string(format_chars),
+        columns.split(",") if columns else []
+    )
+
+
+def index_dataflash(data):
+    """
+    Walk the record framing once and group record offsets by FMT definition.
+
+    Unknown types and corrupt bytes are skipped by resyncing on the next
+    header, the same way pymavlink's DFReader recovers.
+    """
+    fmt_format = DataFlashFormat("FMT", DF_FMT_LENGTH, "BBnNZ", ["Type", "Length", "Name", "Format", "Columns"])
+    formats = {DF_FMT_TYPE: fmt_format}
+    segments = [fmt_format]
+    data_len = len(data)
+    offset = 0
+
+    while offset + 3 <= data_len:
+        if data[offset] != 0xA3 or data[offset + 1] != 0x95:
+            offset = data.find(DF_HEADER, offset + 1)
+            if offset == -1:
+                break
+            continue
+
+        fmt = formats.get(data[offset + 2])
+        if fmt is None or offset + fmt.length > data_len:
+            offset += 1
+            continue
+
+        if fmt is fmt_format:
+            try:
+                msg_type, new_fmt = _parse_fmt(data[offset + 3:offset + DF_FMT_LENGTH])
+            except (KeyError, struct.error, TypeError):
+                new_fmt = None
+            if new_fmt is not None:
+                current = formats.get(msg_type)
+                if current is None or not current.same_definition(new_fmt):
+                    formats[msg_type] = new_fmt
+                    segments.append(new_fmt)
+
+        fmt.offsets.append(offset)
+        offset += fmt.length
+
+    return segments
+
+
+def _decode_records(data, fmt, offsets):
+    """Gather a batch of records into a structured array and split it into named columns."""
+    # A zero-copy window of itemsize bytes starting at every byte; indexing it copies
+    # just the record bodies, without building an (n, itemsize) index matrix
+    windows = np.lib.stride_tricks.sliding_window_view(np.frombuffer(data, dtype=np.uint8), fmt.dtype.itemsize)
+    records = windows[offsets + 3].view(fmt.dtype).ravel()
+
+    columns = {}
+    for i, (name, char) in enumerate(zip(fmt.columns, fmt.format_chars)):
+        values = records[f"f{i}"]
+        divisor = DF_FORMATS[char][1]
+        if char in "nNZ":
+            column = _decode_strings(values)
+        elif char == "a":
+            column = np.empty(len(values), dtype=object)
+            column[:] = values.tolist()
+        elif divisor is not None:
+            column = values / divisor
+        elif char == "g":
+            column = values.astype(np.float64)
+        else:
+            column = values.copy()
+        field_name, column = normalize_field(name, column)
+        columns[field_name] = column
+    return columns
+
+
+def read_dataflash(path, builder, batch_size=65536, progress=None):
+    """Decode an ArduPilot DataFlash log into ``builder``; returns the number of records read."""
+    records = 0
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for fmt in index_dataflash(data):
+                if fmt.dtype.itemsize > fmt.length - 3:
+                    print(f"[Warning] FMT for '{fmt.name}' is longer than its record length — skipped.")
+                    continue
+                offsets = np.frombuffer(fmt.offsets, dtype=np.int64)
+                for start in range(0, len(offsets), batch_size):
+                    batch = offsets[start:start + batch_size]
+                    builder.append(fmt.name.lower(), _decode_records(data, fmt, batch))
+                    records += len(batch)
+                    if progress:
+                        progress(records)
+        finally:
+            data.close()
+    return records
+
+
+# --- MAVLink telemetry (.tlog) ------------------------------------------------
+
+
+def read_mavlink(path, builder, batch_size=4096, progress=None):
+    """
+    Decode a MAVLink log with pymavlink into ``builder``; returns the number of records read.
+
+    Records are batched per message type as plain value lists and flushed into
+    the column buffers every ``batch_size`` records, never as per-row dicts.
+    """
+    connection = mavutil.mavlink_connection(path)
+    batches = {}
+    records = 0
+
+    def flush(msg_type):
+        fieldnames, rows = batches[msg_type]
+        if not rows:
+            return
+        columns = dict(
+            normalize_field(field, to_column(values))
+            for field, values in zip(fieldnames, map(list, zip(*rows)))
+        )
+        builder.append(msg_type.lower(), columns)
+        rows.clear()
+        if progress:
+            progress(records)
+
+    while True:
+        msg = connection.recv_msg()
+        if msg is None:
+            break
+        msg_type = msg.get_type()
+        if msg_type in SKIPPED_MESSAGE_TYPES:
+            continue
+
+        batch = batches.get(msg_type)
+        if batch is None:
+            batch = batches[msg_type] = (list(msg.get_fieldnames()), [])
+        fieldnames, rows = batch
+        rows.append([getattr(msg, field) for field in fieldnames])
+        records += 1
+
+        if len(rows) >= batch_size:
+            flush(msg_type)
+
+    for msg_type in batches:
+        flush(msg_type)
+
+    return records
@@ -1,35 +1,132 @@
-from pymavlink import mavutil
-import json
-import numpy as np
-import gzip
-
-logfile = "arenaTest.bin"
-m = mavutil.mavlink_connection(logfile)
-
-data_by_type = {}
-
-def make_json_safe(obj):
-    if isinstance(obj, bytes):
-        return obj.decode(errors="ignore")
-    elif isinstance(obj, (list, tuple)):
-        return [make_json_safe(i) for i in obj]
-    elif isinstance(obj, dict):
-        return {k.lower(): make_json_safe(v) for k, v in obj.items()}
-    elif hasattr(obj, 'tolist'):
-        return obj.tolist()
-    elif isinstance(obj, (np.integer, np.floating)):
-        return obj.item()
-    return obj
-
-while True:
-    msg = m.recv_match(blocking=False)
-    if msg is None:
-        break
-    msg_dict = make_json_safe(msg.to_dict())
-    msg_type = msg.get_type().lower()
-    if msg_type not in data_by_type:
-        data_by_type[msg_type] = []
-    data_by_type[msg_type].append(msg_dict)
-
-with gzip.open("parsed_arenaTest.json.gz", "wt", encoding="utf-8") as f:
-    json.dump(data_by_type, f, indent=2)
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from cache import DEFAULT_CACHE_DIR, DatasetCache, hash_file
+from dataset import MANIFEST_FILE
+from logreader import read_log
+
+LOG_EXTENSIONS = {".bin", ".log", ".tlog"}
+
+
+def find_logs(inputs):
+    """Expand files, directories (searched recursively) and glob patterns into a sorted list of logs."""
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                for name in files:
+                    if os.path.splitext(name)[1].lower() in LOG_EXTENSIONS:
+                        paths.add(os.path.join(root, name))
+        elif glob.has_magic(item):
+            paths.update(p for p in glob.glob(item, recursive=True) if os.path.isfile(p))
+        else:
+            paths.add(item)
+    return sorted(paths)
+
+
+def output_path(logfile, output_dir):
+    return os.path.join(output_dir, "parsed_" + os.path.splitext(os.path.basename(logfile))[0])
+
+
+def is_up_to_date(logfile, output):
+    manifest = os.path.join(output, MANIFEST_FILE)
+    return os.path.exists(manifest) and os.path.getmtime(manifest) >= os.path.getmtime(logfile)
+
+
+def convert_log(logfile, output, cache_dir=None):
+    """Convert one log (runs in a worker process). Errors are returned, not raised, so one bad log cannot stop the batch."""
+    try:
+        start = time.perf_counter()
+        cache = DatasetCache(cache_dir) if cache_dir else None
+        key = hash_file(logfile) if cache else None
+        dataset = cache.get(key) if cache else None
+        cached = dataset is not None
+
+        if dataset is None:
+            dataset, stats = read_log(logfile)
+            if not stats["records"]:
+                return {"logfile": logfile, "error": "no log records found"}
+            if cache:
+                cache.put(key, dataset)
+
+        dataset.save(output)
+        return {
+            "logfile": logfile,
+            "output": output,
+            "records": sum(dataset.num_rows(msg) for msg in dataset.keys()),
+            "bytes": os.path.getsize(logfile),
+            "elapsed_s": time.perf_counter() - start,
+            "message_types": len(dataset),
+            "cached": cached
+        }
+    except Exception as e:
+        return {"logfile": logfile, "error": f"{type(e).__name__}: {e}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert .bin/.tlog flight logs into columnar dataset directories.")
+    parser.add_argument("inputs", nargs="*", default=["arenaTest.bin"],
+                        help="Log files, directories or glob patterns (e.g. 'logs/**/*.bin')")
+    parser.add_argument("-o", "--output-dir", default=".", help="Where to write parsed_<log name>/ directories")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--force", action="store_true", help="Re-convert logs whose output is already up to date")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Shared content-addressed dataset cache")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or populate the dataset cache")
+    args = parser.parse_args()
+
+    logs = find_logs(args.inputs)
+    if not logs:
+        parser.error("no log files found")
+
+    outputs = {}
+    for logfile in logs:
+        output = output_path(logfile, args.output_dir)
+        if output in outputs:
+            parser.error(f"{logfile} and {outputs[output]} would both be written to {output}")
+        outputs[output] = logfile
+
+    pending = []
+    skipped = 0
+    for output, logfile in outputs.items():
+        if not args.force and is_up_to_date(logfile, output):
+            print(f"  - {logfile}: up to date, skipped")
+            skipped += 1
+        else:
+            pending.append((logfile, output))
+
+    print(f"Converting {len(pending)} of {len(logs)} logs with {args.jobs} worker(s)")
+    start = time.perf_counter()
+    converted = []
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        cache_dir = None if args.no_cache else args.cache_dir
+        futures = [pool.submit(convert_log, logfile, output, cache_dir) for logfile, output in pending]
+        for future in as_completed(futures):
+            result = future.result()
+            if "error" in result:
+                failed.append(result)
+                print(f"  ✗ {result['logfile']}: {result['error']}")
+                continue
+            converted.append(result)
+            elapsed = result["elapsed_s"] or 1e-9
+            source = " (from cache)" if result["cached"] else ""
+            print(f"  ✓ {result['logfile']}: {result['records']} records in {elapsed:.2f}s{source} "
+                  f"({result['records'] / elapsed:.0f} records/s, {result['bytes'] / elapsed / 1e6:.1f} MB/s)")
+
+    wall = time.perf_counter() - start
+    total_records = sum(r["records"] for r in converted)
+    total_bytes = sum(r["bytes"] for r in converted)
+    print()
+    print(f"Converted: {len(converted)}  Skipped: {skipped}  Failed: {len(failed)}")
+    if converted:
+        print(f"Total: {total_records} records, {total_bytes / 1e6:.1f} MB in {wall:.2f}s "
+              f"({total_records / wall:.0f} records/s, {total_bytes / wall / 1e6:.1f} MB/s)")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
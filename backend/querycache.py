@@ -0,0 +1,92 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_CLASSIFICATION_CACHE_PATH = os.getenv("CLASSIFICATION_CACHE_PATH", "classification_cache.sqlite3")
+DEFAULT_CLASSIFICATION_CACHE_TTL_S = float(os.getenv("CLASSIFICATION_CACHE_TTL_S", 7 * 24 * 3600))
+DEFAULT_CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.getenv("CLASSIFICATION_CACHE_MAX_ENTRIES", 10_000))
+
+PUNCTUATION = re.compile(r"[^\w\s]")
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    """Fold case, punctuation and whitespace: "What was the MAX altitude?" -> "what was the max altitude"."""
+    return WHITESPACE.sub(" ", PUNCTUATION.sub(" ", query.lower())).strip()
+
+
+class ClassificationCache:
+    """
+    Persistent Stage 1 results keyed by normalized query text.
+
+    Entries live in a small SQLite file, so they survive restarts and are
+    shared by every worker process on the host. Entries older than ``ttl_s``
+    are ignored and purged; past ``max_entries`` the least recently used
+    ones are dropped. ``namespace`` (e.g. a hash of the model and prompt)
+    is part of every key, so changing the classifier invalidates old entries.
+    """
+
+    def __init__(self, path=DEFAULT_CLASSIFICATION_CACHE_PATH, ttl_s=DEFAULT_CLASSIFICATION_CACHE_TTL_S,
+                 max_entries=DEFAULT_CLASSIFICATION_CACHE_MAX_ENTRIES, namespace=""):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS classifications "
+            "(key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+
+    def key(self, query):
+        return f"{self.namespace}:{normalize_query(query)}"
+
+    def get(self, query):
+        """Return the cached classification for ``query``, or None if missing or expired."""
+        key = self.key(query)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                "SELECT result FROM classifications WHERE key = ? AND created >= ?", (key, now - self.ttl_s)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE classifications SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, query, result):
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO classifications (key, result, created, accessed) VALUES (?, ?, ?, ?)",
+                (self.key(query), json.dumps(result), now, now)
+            )
+            self.evict(now)
+
+    def evict(self, now):
+        self.db.execute("DELETE FROM classifications WHERE created < ?", (now - self.ttl_s,))
+        self.db.execute(
+            "DELETE FROM classifications WHERE key NOT IN "
+            "(SELECT key FROM classifications ORDER BY accessed DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+
+    def stats(self):
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,74 @@
+import math
+import numpy as np
+
+FLOAT_DIGITS = 4
+
+
+def json_column(values, digits=FLOAT_DIGITS):
+    """
+    Convert a column slice into a JSON-safe list in one vectorized pass.
+
+    Floats are rounded with ``np.round`` and NaN/Inf become None; other
+    dtypes are converted with ``tolist`` (bytes are decoded).
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        finite = np.isfinite(values)
+        rounded = np.round(values, digits).tolist()
+        if finite.all():
+            return rounded
+        return [v if ok else None for v, ok in zip(rounded, finite.tolist())]
+    if values.dtype.kind == "S":
+        return [v.decode(errors="ignore") for v in values.tolist()]
+    if values.dtype.kind == "O":
+        return [json_value(v, digits) for v in values.tolist()]
+    return values.tolist()
+
+
+def json_value(value, digits=FLOAT_DIGITS):
+    """JSON-safe form of one scalar: rounded finite float, None for NaN/Inf, plain Python for NumPy types."""
+    kind = type(value)
+    if kind is float:
+        return round(value, digits) if math.isfinite(value) else None
+    if kind is int or kind is str or kind is bool or value is None:
+        return value
+    if isinstance(value, np.ndarray):
+        return json_column(value, digits)
+    if isinstance(value, np.generic):
+        return json_value(value.item(), digits)
+    if isinstance(value, bytes):
+        return value.decode(errors="ignore")
+    return value
+
+
+def sanitize(payload, digits=FLOAT_DIGITS):
+    """
+    Make a freshly built response JSON-safe in place and return it.
+
+    Replaces NaN/Inf with None, rounds floats and converts NumPy scalars and
+    arrays, walking the containers with an explicit stack. Values are only
+    written back when they change, so no copy of the payload is built; do not
+    pass structures that are shared with the dataset (e.g. catalog entries).
+    """
+    if not isinstance(payload, (dict, list)):
+        return json_value(payload, digits)
+
+    stack = [payload]
+    while stack:
+        container = stack.pop()
+        if type(container) is dict:
+            items = list(container.items())
+        else:
+            items = enumerate(container)
+        for key, value in items:
+            kind = type(value)
+            if kind is float:
+                container[key] = round(value, digits) if value - value == 0 else None
+            elif kind is dict or kind is list:
+                stack.append(value)
+            elif kind is tuple:
+                container[key] = value = list(value)
+                stack.append(value)
+            elif kind is not int and kind is not str and kind is not bool and value is not None:
+                container[key] = json_value(value, digits)
+    return payload
@@ -1,17 +1,10 @@
 from flask import jsonify
-import os
-from dotenv import load_dotenv
-import openai
+import asyncio
+import hashlib
 import json
-
-# Load environment variables
-load_dotenv('secret.env')
-
-# Set OpenAI API key
-api_key = os.getenv('OPENAI_API_KEY')
-if not api_key:
-    raise ValueError("OPENAI_API_KEY not found in environment variables")
-openai.api_key = api_key
+import llm
+from fastpath import FastPathClassifier
+from querycache import ClassificationCache, normalize_query
 
 # Load field-to-messages mapping once
 with open("field_to_messages.json", "r") as f:
@@ -21,19 +14,22 @@ with open("field_to_messages.json", "r") as f:
 with open("message_definitions.json", "r") as f:
     message_definitions = json.load(f)
 
-def fallback_response(error_msg, original_query=None):
-    return jsonify({
+def fallback_result(error_msg, original_query=None):
+    return {
         "intent": "fallback",
         "target": "",
         "target_type": "",
         "candidate_messages": None,
         "error": error_msg,
         "original_query": original_query
-    })
+    }
 
-# LLM call
-def call_intent_classifier(user_query):
-    system_prompt = """You are a telemetry intent classifier for drone flight logs.
+def fallback_response(error_msg, original_query=None):
+    return jsonify(fallback_result(error_msg, original_query))
+
+INTENT_MODEL = "gpt-4.1-nano"
+
+INTENT_SYSTEM_PROMPT = """You are a telemetry intent classifier for drone flight logs.
 
 Your job is to extract:
 1. intent — one of:
@@ -47,6 +43,8 @@ Your job is to extract:
 
 4. query_time_us (optional) — if the user asks for the value **at a specific time**, return the time in microseconds (1 second = 1,000,000 us). Otherwise, omit.
 
+5. top_k (optional) — for max_value or min_value, if the user asks for several of the highest or lowest values (e.g. "the 3 highest peaks"), return how many. Otherwise, omit.
+
 Guidelines:
 - Use only valid telemetry field or message names from ArduPilot logs (e.g., "GPS", "Alt", "Spd", "Volt", "Curr", "ERR", etc.).
 - Do not invent field or message names. Avoid combined names like "gps_speed", "battery_voltage", or "rc_signal_strength".
@@ -69,6 +67,9 @@ Q: "What was the highest altitude reached during the flight?"
 Q: "When did the GPS signal first get lost?"
 → { "intent": "event_detection", "target": "GPS", "target_type": "message" }
 
+Q: "What were the 5 highest current draws?"
+→ { "intent": "max_value", "target": "Curr", "target_type": "field", "top_k": 5 }
+
 Q: "What was the maximum battery temperature?"
 → { "intent": "max_value", "target": "Temp", "target_type": "field" }
 
@@ -85,28 +86,102 @@ Q: "What was the altitude at 10 seconds into the flight?"
 → { "intent": "value_at_time", "target": "Alt", "target_type": "field", "query_time_us": 10000000 }
 """
 
-    client = openai.OpenAI()
-    response = client.chat.completions.create(
-        model="gpt-4.1-nano",
-        temperature=0.2,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_query}
-        ]
-    )
+# Common question shapes are classified locally; the rest go to the LLM
+fast_path = FastPathClassifier(field_to_messages, message_definitions)
+
+INTENT_COMPLETION_ARGS = {"temperature": 0.2}
 
-    return response.choices[0].message.content
+# Classifications of previously seen queries, invalidated when the model, prompt or backend changes
+classification_cache = ClassificationCache(
+    namespace=hashlib.sha256((llm.backend.name + INTENT_MODEL + INTENT_SYSTEM_PROMPT).encode()).hexdigest()[:16]
+)
+
+def intent_messages(user_query):
+    return [
+        {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+        {"role": "user", "content": user_query}
+    ]
+
+# LLM call
+def call_intent_classifier(user_query):
+    return llm.backend.complete(INTENT_MODEL, intent_messages(user_query), **INTENT_COMPLETION_ARGS)
+
+async def call_intent_classifier_async(user_query):
+    """Same as ``call_intent_classifier``, awaiting the model instead of blocking a thread."""
+    return await llm.backend.complete_async(INTENT_MODEL, intent_messages(user_query), **INTENT_COMPLETION_ARGS)
+
+def stub_intent_reply(messages):
+    """Offline classifier for the stub backend: the fast-path rules, else a flight summary."""
+    parsed = fast_path.classify(messages[-1]["content"])
+    return json.dumps(parsed or {"intent": "summary", "target": "TimeUS", "target_type": "field"})
+
+llm.register_stub(INTENT_MODEL, stub_intent_reply)
 
 def classify(query):
+    """Classify a query and return the Stage 1 result as a Flask response (fast-path and cached results skip the LLM)."""
+    cached = fast_path_classification(query) or cached_classification(query)
+    if cached is not None:
+        return jsonify(cached)
+    try:
+        return jsonify(remember_classification(query, classification_result(call_intent_classifier(query), query)))
+    except Exception as e:
+        return fallback_response(str(e), query)
+
+async def classify_async(query):
+    """Classify a query without blocking the event loop; returns the Stage 1 result dict."""
+    cached = fast_path_classification(query)
+    if cached is not None:
+        return cached
+    # The SQLite cache does disk I/O, so it is used from the default thread pool
+    loop = asyncio.get_running_loop()
+    cached = await loop.run_in_executor(None, cached_classification, query)
+    if cached is not None:
+        return cached
+    try:
+        result = classification_result(await call_intent_classifier_async(query), query)
+        return await loop.run_in_executor(None, remember_classification, query, result)
+    except Exception as e:
+        return fallback_result(str(e), query)
+
+def fast_path_classification(query):
+    """Classify ``query`` locally; returns None when the rules are not confident or the result is invalid."""
+    parsed = fast_path.classify(query)
+    if parsed is None:
+        return None
+    result = classification_from_parsed(parsed, query)
+    if result.get("intent") == "fallback":
+        return None
+    print(f"Stage 1 fast path: {parsed}")
+    return result
+
+def cached_classification(query):
+    result = classification_cache.get(query)
+    if result is not None:
+        print(f"Stage 1 cache hit: {normalize_query(query)!r}")
+    return result
+
+def remember_classification(query, result):
+    """Store successful classifications; fallbacks are retried on the next request."""
+    if result.get("intent") != "fallback":
+        classification_cache.put(query, result)
+    return result
+
+def classification_result(llm_raw, query):
+    """Validate the classifier output and attach candidate messages."""
     try:
-        llm_raw = call_intent_classifier(query)
         print(llm_raw)
-        parsed = json.loads(llm_raw)
+        return classification_from_parsed(json.loads(llm_raw), query)
+    except Exception as e:
+        return fallback_result(str(e), query)
 
+def classification_from_parsed(parsed, query):
+    """Validate a parsed classification (from the LLM or the fast path) and attach candidate messages."""
+    try:
         intent = parsed.get("intent")
         target = parsed.get("target")
         target_type = parsed.get("target_type")
         query_time_us = parsed.get("query_time_us")  # optional, but include if present
+        top_k = parsed.get("top_k")  # optional, for several max/min values
 
         if not intent or not target or not target_type:
             raise ValueError("Missing intent, target, or target_type.")
@@ -124,26 +199,28 @@ def classify(query):
         extra_params = {}
         if query_time_us is not None:
             extra_params["query_time_us"] = query_time_us
+        if isinstance(top_k, int) and top_k > 1:
+            extra_params["top_k"] = top_k
         if extra_params:
             response["extra_params"] = extra_params
 
         if target_type == "message":
             if target_norm in message_definitions:
                 response["candidate_messages"] = None
-                return jsonify(response)
+                return response
             else:
-                return fallback_response(f"Message '{target_norm}' not found", query)
+                return fallback_result(f"Message '{target_norm}' not found", query)
 
         elif target_type == "field":
             candidate_messages = field_to_messages.get(target_norm)
             if candidate_messages:
                 response["candidate_messages"] = candidate_messages
-                return jsonify(response)
+                return response
             else:
-                return fallback_response(f"Field '{target_norm}' not found", query)
+                return fallback_result(f"Field '{target_norm}' not found", query)
 
         else:
-            return fallback_response(f"Invalid target_type: {target_type}", query)
+            return fallback_result(f"Invalid target_type: {target_type}", query)
 
     except Exception as e:
-        return fallback_response(str(e), query)
+        return fallback_result(str(e), query)
@@ -2,7 +2,11 @@ import gzip
 import json
 import random
 import numpy as np
-import math
+from anomaly import detect_anomalies
+from dataset import LogDataset, present_mask, time_distance, to_python, top_k_indices
+from evidence import row_ref
+from lod import bucket_extremes
+from sanitize import json_column, sanitize
 
 # # Load the compressed JSON file
 # file_path = "parsed_arenaTest.json.gz"
@@ -14,7 +18,7 @@ import math
 with open("message_definitions.json", "r") as f:
     message_definitions = json.load(f)
 
-def run_stage_2(classified: dict, parsed_data: dict): #, parsed_data: dict
+def run_stage_2(classified: dict, parsed_data: LogDataset):
     intent = classified.get("intent")
     target_type = classified.get("target_type")
     target = classified.get("target")
@@ -43,11 +47,17 @@ def run_stage_2(classified: dict, parsed_data: dict): #, parsed_data: dict
         if target not in message_definitions:
             return build_response(intent, target, [], None, error=f"Unknown message type '{target}'.")
 
+        if intent == "summary":
+            # The summary already covers every field of the message
+            return dispatch_intent(intent, target, [target], parsed_data, extra_params)
+
         if is_field_based_intent(intent):
             fields = message_definitions[target].get("fields", [])
+            # Skip fields this log never recorded, per the statistics catalog
             valid_fields = [
                 f for f in fields
                 if f.lower() not in {"timeus", "mavpackettype"}
+                and (parsed_data.field_stats(target, f.lower()) or {}).get("count")
             ]
             print(f"Valid fields: {valid_fields}")
 
@@ -78,9 +88,9 @@ def dispatch_intent(intent, target_field, candidate_messages, parsed_data, extra
     extra_params = extra_params or {}
 
     if intent == "max_value":
-        return handle_max_value(target_field, candidate_messages, parsed_data)
+        return handle_max_value(target_field, candidate_messages, parsed_data, extra_params.get("top_k", 1))
     elif intent == "min_value":
-        return handle_min_value(target_field, candidate_messages, parsed_data)
+        return handle_min_value(target_field, candidate_messages, parsed_data, extra_params.get("top_k", 1))
     elif intent == "event_detection":
         return handle_event_detection(target_field, candidate_messages, parsed_data)
     elif intent == "time_duration":
@@ -117,102 +127,102 @@ def build_response(intent, field, candidate_messages, evidence, **optional):
     }
 
     response.update({k: v for k, v in optional.items() if v is not None})
-    
-    # Ensure all values are JSON serializable by handling NaN values
-    return handle_nan_values(response)
+
+    # Replace NaN/Inf, round floats and convert NumPy values in place
+    return sanitize(response)
 
 
-def handle_max_value(field, candidate_messages, parsed_data):
+def handle_max_value(field, candidate_messages, parsed_data, top_k=1):
     max_values = []
 
+    if top_k > 1:
+        # The top_k extreme rows across all candidate messages
+        for msg, idx in parsed_data.top_k(field, candidate_messages, top_k):
+            max_values.append({
+                "message_type": msg,
+                "value": to_python(parsed_data.values_at(msg, field, idx)),
+                "time": parsed_data.time_at(msg, idx),
+                "row_index": int(idx)
+            })
+        return build_response("max_value", field, candidate_messages, max_values or None)
+
     for msg in candidate_messages:
-        max_entry = None
-        for row in parsed_data.get(msg, []):
-            if field in row:
-                if max_entry is None or row[field] > max_entry["value"]:
-                    max_entry = {
-                        "message_type": msg,
-                        "value": row[field],
-                        "time": row.get("timeus"),
-                        "full_row": row
-                    }
-        if max_entry:
-            max_values.append(max_entry)
+        stats = parsed_data.field_stats(msg, field)
+        if not stats or "argmax" not in stats:
+            continue
+        idx = stats["argmax"]
+        max_values.append({
+            "message_type": msg,
+            "value": to_python(parsed_data.values_at(msg, field, idx)),
+            "time": stats["argmax_time"],
+            "row_index": int(idx)
+        })
 
     return build_response("max_value", field, candidate_messages, max_values or None)
 
 
-def handle_min_value(field, candidate_messages, parsed_data):
+def handle_min_value(field, candidate_messages, parsed_data, top_k=1):
     min_values = []
 
-    for msg in candidate_messages:
-        min_entry = None
-        for row in parsed_data.get(msg, []):
-            if field in row:
-                if min_entry is None or row[field] < min_entry["value"]:
-                    min_entry = {
-                        "message_type": msg,
-                        "value": row[field],
-                        "time": row.get("timeus"),
-                        "full_row": row
-                    }
-        if min_entry:
-            min_values.append(min_entry)
-
-    return build_response("min_value", field, candidate_messages, min_values or None)
-
-
-def handle_event_detection(field, candidate_messages, parsed_data, max_transitions=10):
-    transitions = []
+    if top_k > 1:
+        # The top_k extreme rows across all candidate messages
+        for msg, idx in parsed_data.top_k(field, candidate_messages, top_k, largest=False):
+            min_values.append({
+                "message_type": msg,
+                "value": to_python(parsed_data.values_at(msg, field, idx)),
+                "time": parsed_data.time_at(msg, idx),
+                "row_index": int(idx)
+            })
+        return build_response("min_value", field, candidate_messages, min_values or None)
 
     for msg in candidate_messages:
-        rows = parsed_data.get(msg, [])
-        prev_value = None
-
-        field_values = [row[field] for row in rows if field in row]
-        if len(set(field_values)) <= 1:
-            continue  # skip fields that never change
-
-        for row in rows:
-            if field not in row:
-                continue
-            current_value = row[field]
-            time = row.get("timeus")
+        stats = parsed_data.field_stats(msg, field)
+        if not stats or "argmin" not in stats:
+            continue
+        idx = stats["argmin"]
+        min_values.append({
+            "message_type": msg,
+            "value": to_python(parsed_data.values_at(msg, field, idx)),
+            "time": stats["argmin_time"],
+            "row_index": int(idx)
+        })
 
-            if prev_value is not None and current_value != prev_value:
-                transitions.append({
-                    "message_type": msg,
-                    "field": field,
-                    "old_value": prev_value,
-                    "new_value": current_value,
-                    "time": time,
-                    "full_row": row
-                })
+    return build_response("min_value", field, candidate_messages, min_values or None)
 
-            prev_value = current_value
 
-    # Cap transitions to avoid overwhelming Stage 3
-    # transitions = transitions[:max_transitions]
-    transitions = transitions # TODO: Turn off max transitions for now
+def handle_event_detection(field, candidate_messages, parsed_data, max_transitions=50):
+    total_transitions, sampled = sample_transitions(field, candidate_messages, parsed_data, max_transitions,
+                                                    keep_first_last=True)
+    transitions = [
+        {"message_type": msg, "field": field, "old_value": old, "new_value": new, "time": time, "row_index": row}
+        for msg, time, old, new, row in sampled
+    ]
 
-    return build_response(
+    # The evidence is JSON-safe already (built with json_column), so only the envelope is sanitized
+    result = build_response(
         intent="event_detection",
         field=field,
         candidate_messages=candidate_messages,
-        evidence=transitions or None
+        evidence=None,
+        total_transitions=total_transitions
     )
+    result["evidence"] = transitions or None
+    if total_transitions > len(transitions):
+        result["note"] = (f"Sampled {len(transitions)} of {total_transitions} transitions evenly across the flight, "
+                          "keeping the first, the last and the largest transition in each time bucket.")
+    return result
 
 
 def handle_time_duration(field, candidate_messages, parsed_data):
     durations = []
 
     for msg in candidate_messages:
-        timestamps = [row["timeus"] for row in parsed_data.get(msg, []) if "timeus" in row]
-        if not timestamps:
+        schema = parsed_data.schema.get(msg)
+        if not schema or schema["start_time"] is None:
             continue
 
-        start_time = min(timestamps)
-        end_time = max(timestamps)
+        start_time = schema["start_time"]
+        end_time = schema["end_time"]
         duration_us = end_time - start_time
         duration_s = duration_us / 1e6
 
@@ -228,72 +238,58 @@ def handle_time_duration(field, candidate_messages, parsed_data):
 
 
 def handle_value_at_time(field, candidate_messages, parsed_data, query_time_us, window_us=500_000, max_per_msg=5):
-    def get_matching_field(row, target_field):
-        for key in row:
-            if key.lower() == target_field.lower():
-                return key
-        return None
-
+    field = field.lower()
     results = []
     availability_report = []
 
     for msg in candidate_messages:
-        message_rows = parsed_data.get(msg, [])
-
-        if not message_rows:
+        if parsed_data.num_rows(msg) == 0:
             availability_report.append({
                 "message_type": msg,
                 "status": "no_data"
             })
             continue
 
-        sample_row = next((r for r in message_rows if "timeus" in r), None)
-        available_fields = list(sample_row.keys()) if sample_row else []
-
-        matched_rows = []
-        for row in message_rows:
-            if "timeus" not in row:
-                continue
-            matching_field = get_matching_field(row, field)
-            if matching_field is None:
-                continue
-            diff = abs(row["timeus"] - query_time_us)
-            if diff <= window_us:
-                matched_rows.append({
+        index = parsed_data.time_index(msg)
+
+        if index is None or not len(index) or not parsed_data.has_field(msg, field):
+            availability_report.append({
+                "message_type": msg,
+                "status": "field_not_present",
+                "available_fields_sample": parsed_data.fields(msg)
+            })
+            continue
+
+        times = parsed_data.timeus(msg)
+        matched = index.window(query_time_us - window_us, query_time_us + window_us)
+        values = parsed_data.values_at(msg, field, matched)
+        present = present_mask(values)
+        matched, values = matched[present], values[present]
+
+        if len(matched):
+            diffs = time_distance(times[matched], query_time_us)
+            order = np.argsort(diffs, kind="stable")[:max_per_msg]
+            for idx, value, diff in zip(matched[order], values[order], diffs[order]):
+                results.append({
                     "message_type": msg,
-                    "value": row[matching_field],
-                    "timestamp": row["timeus"],
-                    "difference_us": diff,
-                    "full_row": row
+                    "value": to_python(value),
+                    "timestamp": to_python(times[idx]),
+                    "difference_us": to_python(diff),
+                    "row_index": int(idx)
                 })
-
-        if matched_rows:
-            results.extend(sorted(matched_rows, key=lambda r: r["difference_us"])[:max_per_msg])
             availability_report.append({
                 "message_type": msg,
                 "status": "matched_rows",
-                "count": len(matched_rows)
+                "count": len(matched)
             })
         else:
-            has_field_anywhere = any(get_matching_field(r, field) for r in message_rows)
-            if has_field_anywhere:
-                closest = min(
-                    ((abs(r["timeus"] - query_time_us), r["timeus"])
-                     for r in message_rows if "timeus" in r),
-                    default=(None, None)
-                )
-                availability_report.append({
-                    "message_type": msg,
-                    "status": "field_present_but_out_of_window",
-                    "closest_timeus": closest[1],
-                    "time_diff_us": closest[0]
-                })
-            else:
-                availability_report.append({
-                    "message_type": msg,
-                    "status": "field_not_present",
-                    "available_fields_sample": available_fields
-                })
+            closest = index.nearest(query_time_us)[0]
+            availability_report.append({
+                "message_type": msg,
+                "status": "field_present_but_out_of_window",
+                "closest_timeus": to_python(times[closest]),
+                "time_diff_us": to_python(time_distance(times[closest], query_time_us))
+            })
 
     return build_response(
         "value_at_time",
@@ -305,59 +301,43 @@ def handle_value_at_time(field, candidate_messages, parsed_data, query_time_us,
     )
 
 
-def handle_nan_values(obj):
-    """Recursively replace NaN values with None and truncate floats to 4 decimal places for JSON serialization."""
-    if isinstance(obj, dict):
-        return {k: handle_nan_values(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [handle_nan_values(v) for v in obj]
-    elif isinstance(obj, float):
-        if math.isnan(obj) or math.isinf(obj):
-            return None
-        else:
-            return round(obj, 4)
-    else:
-        return obj
-
-
 def handle_summary(target, candidate_messages, parsed_data, sample_size=5):
     summary = {}
 
     for msg in candidate_messages:
-        entries = parsed_data.get(msg, [])
-        if not entries:
+        entry_count = parsed_data.num_rows(msg)
+        if not entry_count:
             summary[msg] = {"entry_count": 0, "fields": []}
             continue
 
-        sample_rows = entries[:sample_size]
         field_values = {}
 
-        for field in entries[0].keys():
-            values = [row[field] for row in entries if field in row]
-            numeric_values = [v for v in values if isinstance(v, (int, float))]
+        for field in parsed_data.fields(msg):
+            stats = parsed_data.field_stats(msg, field)
 
+            # Only fields with gaps need a presence scan to find sample values
+            if not stats["nan_count"]:
+                samples = parsed_data.values_at(msg, field, np.arange(min(3, entry_count)))
+            else:
+                column = parsed_data.column(msg, field)
+                samples = column[np.flatnonzero(present_mask(column))[:3]]
             field_summary = {
-                "sample_values": values[:3]  # adjust as needed
+                "sample_values": [to_python(v) for v in samples]  # adjust as needed
             }
 
-            if numeric_values:
-                # Handle potential NaN values from numpy operations
-                min_val = np.min(numeric_values)
-                max_val = np.max(numeric_values)
-                mean_val = np.mean(numeric_values)
-                
+            if "mean" in stats:
                 field_summary.update({
-                    "min": float(min_val) if not math.isnan(min_val) else None,
-                    "max": float(max_val) if not math.isnan(max_val) else None,
-                    "mean": float(mean_val) if not math.isnan(mean_val) else None
+                    "min": stats["min"],
+                    "max": stats["max"],
+                    "mean": stats["mean"]
                 })
 
             field_values[field] = field_summary
 
         summary[msg] = {
-            "entry_count": len(entries),
+            "entry_count": entry_count,
             "field_summary": field_values,
-            "sample_rows": sample_rows
+            "sample_rows": [row_ref(msg, i) for i in range(min(sample_size, entry_count))]
         }
 
     return build_response(
@@ -368,46 +348,72 @@ def handle_summary(target, candidate_messages, parsed_data, sample_size=5):
     )
 
 
-def handle_change_detection(field, candidate_messages, parsed_data, max_changes=30):
-    all_changes = []
-    last_value = None
+def sample_transitions(field, candidate_messages, parsed_data, limit, keep_first_last=False):
+    """
+    Transitions of ``field`` across ``candidate_messages``, at most ``limit`` of them.
 
+    Past the limit the transitions are sorted by time, split into equal buckets
+    across the flight and the largest one of each bucket is kept (with
+    ``keep_first_last``, the first and last ones always are). Returns the total
+    count and ``(message_type, time, old, new, row_index)`` tuples of JSON-safe values.
+    """
+    found = []
     for msg in candidate_messages:
-        for row in parsed_data.get(msg, []):
-            if field in row:
-                current = row[field]
-                if last_value is not None and current != last_value:
-                    all_changes.append({
-                        "message_type": msg,
-                        "time": row.get("timeus"),
-                        "from": last_value,
-                        "to": current,
-                        "full_row": row
-                    })
-                last_value = current
-
-    total_changes = len(all_changes)
-
-    if total_changes <= max_changes:
-        sampled_changes = all_changes
-    else:
-        # Sort by time and sample evenly across the flight
-        all_changes.sort(key=lambda x: x["time"] or 0)
-        indices = np.linspace(0, total_changes - 1, max_changes, dtype=int)
-        sampled_changes = [all_changes[i] for i in indices]
+        changes = parsed_data.transitions(msg, field)
+        if changes:
+            found.append((msg, changes))
+
+    total = sum(len(changes) for _, changes in found)
+    owners = np.concatenate([np.full(len(changes), n) for n, (_, changes) in enumerate(found)] or [[]]).astype(np.int64)
+    positions = np.concatenate([np.arange(len(changes)) for _, changes in found] or [[]]).astype(np.int64)
+
+    if total > limit:
+        times = np.concatenate([
+            np.zeros(len(changes)) if changes.times is None else changes.time_values().astype(np.float64)
+            for _, changes in found
+        ])
+        magnitudes = np.concatenate([changes.magnitudes() for _, changes in found])
+        order = np.argsort(np.nan_to_num(times), kind="stable")
+        magnitudes = magnitudes[order]
+        if keep_first_last:
+            magnitudes[[0, -1]] = np.inf
+        sampled = order[bucket_extremes(magnitudes, limit)]
+        owners, positions = owners[sampled], positions[sampled]
+
+    # Look up times and values per message in one vectorized pass, then restore the pick order
+    picks = [None] * len(owners)
+    for n, (msg, changes) in enumerate(found):
+        slots = np.flatnonzero(owners == n)
+        rows = changes.rows[positions[slots]]
+        previous_rows = changes.previous_rows[positions[slots]]
+        times = [None] * len(rows) if changes.times is None else json_column(changes.times[rows])
+        for slot, row, time, old, new in zip(slots.tolist(), rows.tolist(), times,
+                                             json_column(changes.column[previous_rows]),
+                                             json_column(changes.column[rows])):
+            picks[slot] = (msg, time, old, new, row)
+    return total, picks
+
+
+def handle_change_detection(field, candidate_messages, parsed_data, max_changes=30):
+    total_changes, sampled = sample_transitions(field, candidate_messages, parsed_data, max_changes)
+    sampled_changes = [
+        {"message_type": msg, "time": time, "from": old, "to": new, "row_index": row}
+        for msg, time, old, new, row in sampled
+    ]
 
-    result = {
+    # The evidence is JSON-safe already (built with json_column), so only the envelope is sanitized
+    result = sanitize({
         "intent": "change_detection",
         "field": field,
         "candidate_messages": candidate_messages,
-        "evidence": sampled_changes,
+        "evidence": None,
         "summary": {
             "total_changes_detected": total_changes,
             "sampled_changes_returned": len(sampled_changes),
-            "note": f"Sampled {len(sampled_changes)} changes evenly across {total_changes} total changes."
+            "note": f"Sampled {len(sampled_changes)} changes evenly across {total_changes} total changes, keeping the largest change in each time bucket."
         }
-    }
-
+    })
+    result["evidence"] = sampled_changes
     return result
 
 
@@ -415,37 +421,38 @@ def handle_anomaly_detection(field, candidate_messages, parsed_data, sample_size
     evidence = []
 
     for msg in candidate_messages:
-        rows = parsed_data.get(msg, [])
-        print(f"Testing {msg} with {len(rows)} number of rows")
-        values = [
-            (row.get("timeus"), row[field], row)
-            for row in rows
-            if field in row and isinstance(row[field], (int, float))
-        ]
-
-        print("\tvalues: ", values)
-
-        if len(values) < 2:
+        values = parsed_data.numeric_column(msg, field)
+        if values is None:
             continue
 
-        sorted_by_value = sorted(values, key=lambda x: x[1])
+        if parsed_data.field_stats(msg, field)["count"] < 2:
+            continue
 
         # Take bottom N and top N to expose extremes
-        samples = sorted_by_value[:sample_size] + sorted_by_value[-sample_size:]
+        samples = np.concatenate([
+            top_k_indices(values, sample_size, largest=False),
+            top_k_indices(values, sample_size)
+        ])
 
-        for t, v, row in samples:
+        for idx in samples:
             evidence.append({
                 "message_type": msg,
-                "time": t,
-                "value": v,
-                "full_row": row
+                "time": parsed_data.time_at(msg, idx),
+                "value": to_python(values[idx]),
+                "row_index": int(idx)
             })
 
+    # Extremes alone cannot tell a spike from a flight phase; add rolling-window segments
+    segments = detect_anomalies(parsed_data, field, candidate_messages, max_segments=10)
+    print(f"Anomaly detection on {field}: {len(evidence)} extreme samples, "
+          f"{segments['segments_found']} anomalous segments")
+
     return build_response(
         intent="anomaly_detection",
         field=field,
         candidate_messages=candidate_messages,
-        evidence=evidence
+        evidence=evidence,
+        anomaly_segments=segments if segments["segments_found"] else None
     )
 
 
@@ -465,31 +472,27 @@ def handle_fallback(parsed_data, rows_per_message=10, seed=42):
     ]
 
     for msg in candidate_messages:
-        rows = parsed_data.get(msg, [])
-        if not rows:
+        row_count = parsed_data.num_rows(msg)
+        if not row_count:
             continue
 
-        if len(rows) <= rows_per_message:
-            sample_rows = rows
-        elif len(rows) < 3 * rows_per_message:
-            sample_rows = random.sample(rows, rows_per_message)
+        if row_count <= rows_per_message:
+            sample_indices = list(range(row_count))
+        elif row_count < 3 * rows_per_message:
+            sample_indices = random.sample(range(row_count), rows_per_message)
         else:
-            third = len(rows) // 3
-            sample_rows = (
-                rows[:rows_per_message // 3] +
-                rows[third:third + rows_per_message // 3] +
-                rows[-(rows_per_message - 2 * (rows_per_message // 3)):]
+            third = row_count // 3
+            sample_indices = (
+                list(range(rows_per_message // 3)) +
+                list(range(third, third + rows_per_message // 3)) +
+                list(range(row_count - (rows_per_message - 2 * (rows_per_message // 3)), row_count))
             )
 
-        for row in sample_rows:
-            evidence.append({
-                "message_type": msg,
-                "row": row
-            })
+        evidence.extend(row_ref(msg, i) for i in sample_indices)
 
     return build_response(
         intent="fallback",
         field=None,
         candidate_messages=candidate_messages,
         evidence=evidence
-    )
\ No newline at end of file
+    )
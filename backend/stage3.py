@@ -1,23 +1,48 @@
-import openai
+import asyncio
 import json
 import os
-from dotenv import load_dotenv
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 import numpy as np
+import llm
 from collections import defaultdict
 from typing import List, Tuple, Set
+from dataset import LogDataset, RunLengthColumn, combine_stats, present_mask, to_python
+from anomaly import DEFAULT_WINDOW, detect_anomalies
+from intervals import duration_curve, threshold_intervals
+from evidence import COMPACT, materialize_evidence
+from lod import bucket_extremes, downsample
+from sanitize import sanitize
+from stage2 import sample_transitions
+from toolcache import ToolResultCache
 
-# Load environment variables
-load_dotenv('secret.env')
-
-# Set OpenAI API key
-api_key = os.getenv('OPENAI_API_KEY')
-if not api_key:
-    raise ValueError("OPENAI_API_KEY not found in environment variables")
+MAX_ROUNDS = 10
 
-# Initialize OpenAI client with new API
-client = openai.OpenAI(api_key=api_key)
+# Tool calls of one round run concurrently on this pool (NumPy kernels release the GIL).
+# A tool that misses its deadline cannot be interrupted and keeps its thread until it
+# finishes; at most MAX_ABANDONED_TOOLS such tools may run at once, on extra threads,
+# so TOOL_WORKERS threads always remain for live calls.
+TOOL_WORKERS = int(os.getenv("STAGE3_TOOL_WORKERS", 8))
+MAX_ABANDONED_TOOLS = int(os.getenv("STAGE3_MAX_ABANDONED_TOOLS", 4))
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS + MAX_ABANDONED_TOOLS, thread_name_prefix="stage3-tool")
+abandoned_tools = 0
+abandoned_lock = threading.Lock()
+
+# Seconds each tool may run, counted from when it starts, before the round continues without it
+DEFAULT_TOOL_TIMEOUT_S = float(os.getenv("STAGE3_TOOL_TIMEOUT_S", 10))
+# Seconds a call may wait in the pool's queue before it is dropped without running
+TOOL_QUEUE_TIMEOUT_S = float(os.getenv("STAGE3_TOOL_QUEUE_TIMEOUT_S", DEFAULT_TOOL_TIMEOUT_S))
+TOOL_TIMEOUTS = {
+    "highlight_anomalies": 2 * DEFAULT_TOOL_TIMEOUT_S,
+    "compute_duration_above_threshold": 2 * DEFAULT_TOOL_TIMEOUT_S,
+    "list_possible_fields": 2.0
+}
 
-MAX_ROUNDS = 10
+# Tool results shared across rounds, clarification turns and chats about the same log
+tool_cache = ToolResultCache()
+STAGE3_MODEL = "gpt-4.1-mini-2025-04-14"
+COMPLETION_ARGS = {"temperature": 0.2, "max_tokens": 800, "response_format": {"type": "json_object"}}
 
 # Available tool names
 AVAILABLE_TOOLS = {
@@ -28,6 +53,8 @@ AVAILABLE_TOOLS = {
     "list_possible_fields",
     "get_change_points",
     "compute_duration_above_threshold",
+    "compute_threshold_intervals",
+    "compute_time_in_state",
     "detect_event_instances"
 }
 
@@ -100,7 +127,7 @@ def get_available_tools():
     """Return list of tool names."""
     return list(AVAILABLE_TOOLS)
 
-def handle_tool_calls(tool_calls, parsed_data):
+def handle_tool_calls(tool_calls, parsed_data: LogDataset):
     """Process validated tool calls with real implementations."""
     print(f"Handling tool calls: {tool_calls}")
     validation = validate_tool_calls(tool_calls)
@@ -112,85 +139,178 @@ def handle_tool_calls(tool_calls, parsed_data):
             "available_tools": get_available_tools()
         }
 
-    results = defaultdict(list)
+    # Repeated calls are served from the cache; the rest run concurrently, each
+    # waited on only until its own deadline
+    calls = validation["valid_calls"]
+    keys = [tool_cache.key(parsed_data, call["tool"], call.get("args", {})) for call in calls]
+    cached = [tool_cache.get(key) for key in keys]
+    submitted = time.monotonic()
+    with abandoned_lock:
+        pool_available = abandoned_tools < MAX_ABANDONED_TOOLS
+    runs = [
+        None if hit is not None or not pool_available else ToolRun(call["tool"], call.get("args", {}), parsed_data)
+        for call, hit in zip(calls, cached)
+    ]
 
-    for call in validation["valid_calls"]:
+    results = defaultdict(list)
+    for call, key, hit, run in zip(calls, keys, cached, runs):
         tool = call["tool"]
         args = call.get("args", {})
-
-        try:
-            if tool == "summarize_field":
-                result = summarize_field(
-                    field=args["field"],
-                    message_types=args["message_types"],
-                    parsed_data=parsed_data
-                )
-
-            elif tool == "get_change_points":
-                result = get_change_points(
-                    field=args["field"],
-                    message_types=args["message_types"],
-                    parsed_data=parsed_data
-                )
-
-            elif tool == "get_values_near_time":
-                result = get_values_near_time(
-                    field=args["field"],
-                    message_types=args["message_types"],
-                    parsed_data=parsed_data,
-                    query_time_us=args["query_time_us"],
-                    tolerance=args.get("tolerance", 1_000_000)
-                )
-
-            elif tool == "compute_duration_above_threshold":
-                result = compute_duration_above_threshold(
-                    field=args["field"],
-                    message_types=args["message_types"],
-                    parsed_data=parsed_data,
-                    threshold=args["threshold"]
-                )
-
-            elif tool == "highlight_anomalies":
-                result = highlight_anomalies(
-                    field=args["field"],
-                    message_types=args["message_types"],
-                    parsed_data=parsed_data,
-                    z_thresh=args.get("z_thresh", 3.0)
-                )
-
-            elif tool == "list_possible_fields":
-                result = list_possible_fields(parsed_data)
-
-            elif tool == "resample_evidence":
-                result = resample_evidence(
-                    evidence=args["evidence"],
-                    n_samples=args.get("n_samples", 10)
-                )
-
-            elif tool == "detect_event_instances":
-                result = detect_event_instances(
-                    field=args["field"],
-                    message_types=args["message_types"],
-                    parsed_data=parsed_data,
-                    trigger_value=args.get("trigger_value", 1)
-                )
-
-            else:
-                result = {"error": f"Unhandled tool '{tool}'"}
-
-        except Exception as e:
-            result = {"error": f"Exception during tool execution: {str(e)}"}
+        timeout = TOOL_TIMEOUTS.get(tool, DEFAULT_TOOL_TIMEOUT_S)
+
+        if hit is not None:
+            print(f"Tool cache hit: {tool}")
+            result = hit
+        elif run is None:
+            result = {"error": f"Tool '{tool}' not run: {MAX_ABANDONED_TOOLS} timed-out tools are still running"}
+        elif not run.started.wait(max(0.0, submitted + TOOL_QUEUE_TIMEOUT_S - time.monotonic())) \
+                and run.future.cancel():
+            result = {"error": f"Tool '{tool}' did not start within {TOOL_QUEUE_TIMEOUT_S:g} s", "timed_out": True}
+        else:
+            run.started.wait()  # it was starting when the queue deadline passed
+            try:
+                result = sanitize(run.future.result(timeout=max(0.0, run.started_at + timeout - time.monotonic())))
+                tool_cache.put(key, result)
+            except TimeoutError:
+                run.abandon()
+                result = {
+                    "error": f"Tool '{tool}' did not finish within {timeout:g} s",
+                    "timed_out": True,
+                    "timeout_s": timeout
+                }
 
         # Pretty print the tool result
         pretty_print_tool_result(tool, args, result)
-        
+
         results[tool].append(result)
 
     return dict(results)
 
+
+class ToolRun:
+    """One tool call submitted to ``tool_executor``; records when it actually starts running."""
+
+    def __init__(self, tool, args, parsed_data: LogDataset):
+        self.started = threading.Event()
+        self.started_at = None
+        self.future = tool_executor.submit(self.run, tool, args, parsed_data)
+
+    def run(self, tool, args, parsed_data):
+        self.started_at = time.monotonic()
+        self.started.set()
+        return run_tool(tool, args, parsed_data)
+
+    def abandon(self):
+        """Stop waiting for a running tool; its thread counts as abandoned until the tool returns."""
+        global abandoned_tools
+        with abandoned_lock:
+            abandoned_tools += 1
+        self.future.add_done_callback(release_abandoned)
+
+
+def release_abandoned(_future):
+    global abandoned_tools
+    with abandoned_lock:
+        abandoned_tools -= 1
+
+
+def run_tool(tool, args, parsed_data: LogDataset):
+    """Run one validated tool call; errors are returned as a result, not raised."""
+    try:
+        if tool == "summarize_field":
+            result = summarize_field(
+                field=args["field"],
+                message_types=args["message_types"],
+                parsed_data=parsed_data
+            )
+
+        elif tool == "get_change_points":
+            result = get_change_points(
+                field=args["field"],
+                message_types=args["message_types"],
+                parsed_data=parsed_data,
+                max_points=args.get("max_points", 50)
+            )
+
+        elif tool == "get_values_near_time":
+            result = get_values_near_time(
+                field=args["field"],
+                message_types=args["message_types"],
+                parsed_data=parsed_data,
+                query_time_us=args["query_time_us"],
+                tolerance=args.get("tolerance", 1_000_000)
+            )
+
+        elif tool == "compute_duration_above_threshold":
+            result = compute_duration_above_threshold(
+                field=args["field"],
+                message_types=args["message_types"],
+                parsed_data=parsed_data,
+                threshold=args["threshold"]
+            )
+
+        elif tool == "compute_threshold_intervals":
+            result = compute_threshold_intervals(
+                field=args["field"],
+                message_types=args["message_types"],
+                parsed_data=parsed_data,
+                above=args.get("above"),
+                below=args.get("below"),
+                max_intervals=args.get("max_intervals", 20)
+            )
+
+        elif tool == "compute_time_in_state":
+            result = compute_time_in_state(
+                field=args["field"],
+                message_types=args["message_types"],
+                parsed_data=parsed_data,
+                value=args.get("value")
+            )
+
+        elif tool == "highlight_anomalies":
+            result = highlight_anomalies(
+                field=args["field"],
+                message_types=args["message_types"],
+                parsed_data=parsed_data,
+                z_thresh=args.get("z_thresh", 3.0),
+                window=args.get("window", DEFAULT_WINDOW),
+                method=args.get("method", "zscore")
+            )
+
+        elif tool == "list_possible_fields":
+            result = list_possible_fields(parsed_data)
+
+        elif tool == "resample_evidence":
+            result = resample_evidence(
+                evidence=args.get("evidence"),
+                n_samples=args.get("n_samples", 10),
+                field=args.get("field"),
+                message_types=args.get("message_types"),
+                parsed_data=parsed_data,
+                start_time=args.get("start_time"),
+                end_time=args.get("end_time"),
+                method=args.get("method", "minmax")
+            )
+
+        elif tool == "detect_event_instances":
+            result = detect_event_instances(
+                field=args["field"],
+                message_types=args["message_types"],
+                parsed_data=parsed_data,
+                trigger_value=args.get("trigger_value", 1)
+            )
+
+        else:
+            result = {"error": f"Unhandled tool '{tool}'"}
+
+    except Exception as e:
+        result = {"error": f"Exception during tool execution: {str(e)}"}
+
+    return result
+
 def handle_tool_calls_with_strategies(
     tool_calls: List[dict],
-    parsed_data: dict,
+    parsed_data: LogDataset,
     available_fields: Set[str],
     attempted_fields: Set[Tuple[str, Tuple[str, ...]]],
     successful_summaries: int,
@@ -257,120 +377,144 @@ def handle_tool_calls_with_strategies(
     }
 
 
-def summarize_field(field: str, message_types: list, parsed_data: dict):
-    values = []
-    for msg in message_types:
-        for row in parsed_data.get(msg, []):
-            if field in row:
-                try:
-                    values.append(float(row[field]))
-                except (ValueError, TypeError):
-                    continue
-
-    if not values:
+def summarize_field(field: str, message_types: list, parsed_data: LogDataset):
+    stats = combine_stats([parsed_data.field_stats(msg, field) for msg in message_types])
+    if stats is None:
         return {"error": f"No valid values found for field '{field}' in messages {message_types}"}
 
-    array = np.array(values)
     return {
-        "min": float(np.min(array)),
-        "max": float(np.max(array)),
-        "mean": float(np.mean(array)),
-        "std": float(np.std(array))
+        "min": stats["min"],
+        "max": stats["max"],
+        "mean": stats["mean"],
+        "std": stats["std"]
     }
 
-def get_change_points(field: str, message_types: list, parsed_data: dict):
-    change_points = []
+def get_change_points(field: str, message_types: list, parsed_data: LogDataset, max_points: int = 50):
+    total, sampled = sample_transitions(field, message_types, parsed_data, max_points, keep_first_last=True)
+    result = {
+        "change_points": [
+            {"time": time, "value": new, "message_type": msg}
+            for msg, time, old, new, row in sampled
+        ],
+        "total_change_points": total
+    }
+    if total > len(sampled):
+        result["note"] = (f"Sampled {len(sampled)} of {total} change points across the flight, keeping the "
+                          f"first, the last and the largest change in each time bucket.")
+    return result
 
-    for msg in message_types:
-        last_val = None
-        for row in parsed_data.get(msg, []):
-            if field in row:
-                val = row[field]
-                if last_val is not None and val != last_val:
-                    change_points.append({
-                        "time": row.get("timeus"),
-                        "value": val,
-                        "message_type": msg
-                    })
-                last_val = val
-
-    return {"change_points": change_points}
-
-def get_values_near_time(field: str, message_types: list, parsed_data: dict, query_time_us: int, tolerance: int = 1_000_000):
+def get_values_near_time(field: str, message_types: list, parsed_data: LogDataset, query_time_us: int, tolerance: int = 1_000_000):
     matched = []
 
     for msg in message_types:
-        for row in parsed_data.get(msg, []):
-            row_time = row.get("timeus")
-            if row_time is not None and abs(row_time - query_time_us) <= tolerance:
-                if field in row:
-                    matched.append({
-                        "time": row_time,
-                        "value": row[field],
-                        "message_type": msg
-                    })
+        index = parsed_data.time_index(msg)
+        if index is None or not parsed_data.has_field(msg, field):
+            continue
+
+        times = parsed_data.timeus(msg)
+        in_window = index.window(query_time_us - tolerance, query_time_us + tolerance)
+        values = parsed_data.values_at(msg, field, in_window)
+        present = present_mask(values)
+        for idx, value in zip(in_window[present], values[present]):
+            matched.append({
+                "time": to_python(times[idx]),
+                "value": to_python(value),
+                "message_type": msg
+            })
 
     return {"matched_rows": matched}
 
 
-def compute_duration_above_threshold(field: str, message_types: list, parsed_data: dict, threshold: float):
-    total_time = 0
-    for msg in message_types:
-        rows = parsed_data.get(msg, [])
-        rows = sorted(rows, key=lambda r: r.get("timeus", 0))
+def compute_duration_above_threshold(field: str, message_types: list, parsed_data: LogDataset, threshold):
+    if isinstance(threshold, list):
+        curve = duration_curve(parsed_data, field, message_types, threshold)
+        if curve is None:
+            return {"error": f"No numeric time series for field '{field}' in messages {message_types}"}
+        return {"duration_curve": curve}
+
+    results = threshold_intervals(parsed_data, field, message_types, above=threshold, max_intervals=5)
+    return {
+        "duration_above_threshold": sum(r["total_duration"] for r in results),
+        "crossings": sum(r["crossings"] for r in results),
+        "intervals": [dict(interval, message_type=r["message_type"]) for r in results for interval in r["intervals"]]
+    }
 
-        for i in range(1, len(rows)):
-            prev, curr = rows[i-1], rows[i]
-            if field in prev and float(prev[field]) > threshold:
-                delta = curr.get("timeus", 0) - prev.get("timeus", 0)
-                total_time += max(delta, 0)
 
-    return {"duration_above_threshold": total_time}
+def compute_threshold_intervals(field: str, message_types: list, parsed_data: LogDataset, above=None, below=None, max_intervals: int = 20):
+    if above is None and below is None:
+        return {"error": "Provide 'above', 'below' or both"}
+    return {"threshold_intervals": threshold_intervals(parsed_data, field, message_types, above, below, max_intervals)}
 
 
-def highlight_anomalies(field: str, message_types: list, parsed_data: dict, z_thresh: float = 3.0):
-    values = []
-    indexed_rows = []
+def compute_time_in_state(field: str, message_types: list, parsed_data: LogDataset, value=None):
+    states = []
 
     for msg in message_types:
-        for row in parsed_data.get(msg, []):
-            if field in row:
-                try:
-                    val = float(row[field])
-                    values.append(val)
-                    indexed_rows.append((row.get("timeus"), val, msg))
-                except (ValueError, TypeError):
-                    continue
-
-    if not values:
-        return {"anomalies_found": 0, "anomalies": []}
-
-    mean = np.mean(values)
-    std = np.std(values)
-
-    anomalies = [
-        {"time": t, "value": v, "message_type": m}
-        for t, v, m in indexed_rows
-        if abs(v - mean) > z_thresh * std
-    ]
+        times = parsed_data.timeus(msg)
+        if times is None or not parsed_data.has_field(msg, field):
+            continue
+
+        runs = parsed_data.runs(msg, field) or RunLengthColumn.encode(parsed_data.column(msg, field))
+        start_times, end_times, values = runs.time_runs(times)
+        present = present_mask(values)
+        if value is not None:
+            present &= values == value
+
+        durations = (end_times - start_times)[present]
+        values = values[present]
+        for state in dict.fromkeys(values.tolist()):
+            in_state = values == state
+            duration_us = to_python(durations[in_state].sum())
+            states.append({
+                "message_type": msg,
+                "value": to_python(state),
+                "duration_us": duration_us,
+                "duration_s": duration_us / 1e6,
+                "intervals": int(in_state.sum())
+            })
+
+    return {"time_in_state": states}
+
+def highlight_anomalies(field: str, message_types: list, parsed_data: LogDataset, z_thresh: float = 3.0,
+                        window: int = DEFAULT_WINDOW, method: str = "zscore", max_segments: int = 20):
+    result = detect_anomalies(parsed_data, field, message_types, z_thresh, window, method, max_segments)
+    return {
+        "anomalies_found": result["segments_found"],
+        "flagged_samples": result["flagged_samples"],
+        "anomalies": result["segments"]
+    }
 
-    return {"anomalies_found": len(anomalies), "anomalies": anomalies}
 
+def list_possible_fields(parsed_data: LogDataset):
+    return {"available_fields": parsed_data.available_fields()}
 
-def list_possible_fields(parsed_data: dict):
-    field_set = set()
-    for msg_rows in parsed_data.values():
-        for row in msg_rows:
-            field_set.update(row.keys())
-    return {"available_fields": sorted(field_set)}
 
+def resample_evidence(evidence: list = None, n_samples: int = 10, field: str = None, message_types: list = None,
+                      parsed_data: LogDataset = None, start_time=None, end_time=None, method: str = "minmax"):
+    """
+    Reduce a series to about ``n_samples`` points without losing its extremes.
+
+    With ``field`` and ``message_types`` the points are served from the field's
+    level-of-detail pyramid, optionally within ``[start_time, end_time]``.
+    Otherwise the given ``evidence`` list is bucketed in order, keeping the
+    entry with the most extreme numeric "value" of each bucket.
+    """
+    if field and message_types:
+        sampled = downsample(parsed_data, field, message_types, n_samples, start_time, end_time, method)
+        if not sampled:
+            return {"error": f"No numeric values found for field '{field}' in messages {message_types}"}
+        return {"resampled_points": len(sampled), "method": method, "resampled": sampled}
 
-def resample_evidence(evidence: list, n_samples: int = 10):
     if not evidence:
         return {"resampled_points": 0, "resampled": []}
 
-    step = max(1, len(evidence) // n_samples)
-    sampled = evidence[::step][:n_samples]
+    values = np.array([
+        e["value"] if isinstance(e, dict) and isinstance(e.get("value"), (int, float)) else np.nan
+        for e in evidence
+    ], dtype=np.float64)
+    present = ~np.isnan(values)
+    magnitudes = np.abs(values - values[present].mean()) if present.any() else np.zeros(len(evidence))
+    sampled = [evidence[i] for i in bucket_extremes(magnitudes, n_samples)]
 
     return {
         "resampled_points": len(sampled),
@@ -378,28 +522,100 @@ def resample_evidence(evidence: list, n_samples: int = 10):
     }
 
 
-def detect_event_instances(field: str, message_types: list, parsed_data: dict, trigger_value=1):
+def detect_event_instances(field: str, message_types: list, parsed_data: LogDataset, trigger_value=1):
     events = []
     for msg in message_types:
-        for row in parsed_data.get(msg, []):
-            if field in row and row[field] == trigger_value:
-                events.append({
-                    "time": row.get("timeus"),
-                    "message_type": msg,
-                    "condition_met": True
-                })
+        column = parsed_data.column(msg, field)
+        if column is None:
+            continue
+        for idx in np.flatnonzero(column == trigger_value):
+            events.append({
+                "time": parsed_data.time_at(msg, idx),
+                "message_type": msg,
+                "condition_met": True
+            })
 
     return {"event_instances": events}
 
 
-def run_stage_3(parsed_data: dict, question=None, stage2=None, extra_context=None, messages=None, model="gpt-4.1-mini-2025-04-14"):
-    parser_data_keys = list(parsed_data.keys())
+def run_stage_3(parsed_data: LogDataset, question=None, stage2=None, extra_context=None, messages=None, model=STAGE3_MODEL):
+    """Run the Stage 3 reasoning loop, blocking on each model round."""
+    if messages is None:
+        messages = stage3_messages(parsed_data, question, stage2, extra_context)
+
+    rounds = stage3_rounds(parsed_data, messages)
+    request, result = advance_rounds(rounds)
+    while result is None:
+        request, result = advance_rounds(rounds, llm.backend.complete(model, request, **COMPLETION_ARGS))
+    return result
+
+
+async def run_stage_3_async(parsed_data: LogDataset, question=None, stage2=None, extra_context=None, messages=None,
+                            model=STAGE3_MODEL, executor=None):
+    """
+    Run the Stage 3 reasoning loop without blocking the event loop.
+
+    Model rounds are awaited on the LLM backend; building the prompt and
+    running tool calls between rounds is CPU work and runs on ``executor``.
+    """
+    loop = asyncio.get_running_loop()
+    if messages is None:
+        messages = await loop.run_in_executor(executor, stage3_messages, parsed_data, question, stage2, extra_context)
+
+    rounds = stage3_rounds(parsed_data, messages)
+    request, result = await loop.run_in_executor(executor, advance_rounds, rounds)
+    while result is None:
+        reply = await llm.backend.complete_async(model, request, **COMPLETION_ARGS)
+        request, result = await loop.run_in_executor(executor, advance_rounds, rounds, reply)
+    return result
+
+
+def stub_stage3_reply(messages):
+    """Offline Stage 3 model for the stub backend: one round of tools on the Stage 2 field, then an answer."""
+    try:
+        request = json.loads(messages[-1]["content"])
+    except ValueError:
+        request = None  # a clarification from the user
+    if isinstance(request, dict) and "original_question" in request and request.get("field") \
+            and request.get("candidate_messages"):
+        args = {"field": request["field"], "message_types": request["candidate_messages"]}
+        return json.dumps({
+            "clarification_needed": False,
+            "tool_calls": [{"tool": "summarize_field", "args": args}, {"tool": "get_change_points", "args": args}]
+        })
+    rounds = sum(message["role"] == "assistant" for message in messages) + 1
+    return json.dumps({"clarification_needed": False, "tool_calls": [],
+                       "final_answer": f"Stub answer after {rounds} model rounds."})
+
+
+llm.register_stub(STAGE3_MODEL, stub_stage3_reply)
+
+
+def advance_rounds(rounds, reply=None):
+    """
+    Resume ``stage3_rounds`` with the model's reply, up to its next request.
+
+    Returns ``(messages, None)`` when the model must be called again and
+    ``(None, result)`` when the loop has finished.
+    """
+    try:
+        return rounds.send(reply), None
+    except StopIteration as done:
+        return None, done.value
+
+
+def stage3_messages(parsed_data: LogDataset, question, stage2, extra_context):
+    """System prompt and Stage 2 evidence for a new Stage 3 conversation."""
+    parser_data_keys = list(parsed_data.schema)
 
     system_prompt = f"""You are a MAVLink log-analysis assistant.
 
 Your job is to process telemetry log queries by combining:
 - the original question ("original_question"),
 - Stage 2's "intent", "field", "candidate_messages" and "evidence",
+- "rows": the full log rows that evidence items point to. An item with "message_type" and
+  "row_index" refers to rows[message_type]["rows"][row_index], whose values are listed in the
+  order of rows[message_type]["columns"]. "truncated", when present, says evidence was thinned to fit,
 - any extra context (e.g. query_time_us, missing sources).
 
 If you have enough information to answer the question accurately and helpfully, you should provide a final answer.
@@ -454,9 +670,11 @@ Available tools:
      - message_types (list[str])
 
 2. get_change_points
+   Times where the field changes value, sampled across the flight past max_points, plus the total count.
    Args:
      - field (str)
      - message_types (list[str])
+     - max_points (int, optional, default = 50)
 
 3. get_values_near_time
    Args:
@@ -466,64 +684,88 @@ Available tools:
      - tolerance (int, optional, default = 1000000)
 
 4. compute_duration_above_threshold
+   Total time above the threshold, how often it was crossed and the first intervals.
+   Pass a list of thresholds to get the duration for each one in a single call.
    Args:
      - field (str)
      - message_types (list[str])
-     - threshold (float)
+     - threshold (float or list[float])
 
 5. highlight_anomalies
+   Segments where the field deviates from its recent behaviour (rolling window), strongest first.
    Args:
      - field (str)
      - message_types (list[str])
      - z_thresh (float, optional, default = 3.0)
+     - window (int, optional, samples, default = 200)
+     - method (str, optional, "zscore" or "mad", default = "zscore")
 
 6. list_possible_fields
    Args: none
 
 7. resample_evidence
    Args:
-     - evidence (list[dict])
+     - field (str) and message_types (list[str]), to sample the field's full series
+       (or evidence (list[dict]), to thin out a list of evidence points)
      - n_samples (int, optional, default = 10)
+     - start_time / end_time (int, optional, microseconds, limits the time range)
+     - method (str, optional, "minmax" keeps each bucket's min and max, "mean" averages buckets,
+       "lttb" keeps the visually most significant points; default = "minmax")
 
 8. detect_event_instances
    Args:
      - field (str)
      - message_types (list[str])
      - trigger_value (int, optional, default = 1)
+
+9. compute_threshold_intervals
+   Time intervals where the field is above, below or between thresholds.
+   Args:
+     - field (str)
+     - message_types (list[str])
+     - above (float, optional)
+     - below (float, optional)
+     - max_intervals (int, optional, default = 20)
+
+10. compute_time_in_state
+   Total time spent in each value of a state field (e.g. flight mode, arming state, GPS status).
+   Args:
+     - field (str)
+     - message_types (list[str])
+     - value (optional, only report this state)
 """
 
-    # === If continuing from clarification, messages will be passed in ===
-    if messages is None:
-        user_prompt = {
-            "original_question": question,
-            "intent": stage2.get("intent"),
-            "field": stage2.get("field"),
-            "candidate_messages": stage2.get("candidate_messages"),
-            "evidence": stage2.get("evidence"),
-            "extra_context": extra_context or {}
-        }
+    user_prompt = {
+        "original_question": question,
+        "intent": stage2.get("intent"),
+        "field": stage2.get("field"),
+        "candidate_messages": stage2.get("candidate_messages"),
+        **materialize_evidence(stage2.get("evidence"), parsed_data),
+        "extra_context": extra_context or {}
+    }
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": json.dumps(user_prompt, separators=COMPACT)}
+    ]
+    return messages
+
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": json.dumps(user_prompt, indent=2)}
-        ]
+def stage3_rounds(parsed_data: LogDataset, messages):
+    """
+    The Stage 3 loop as a generator, independent of how the model is called.
 
+    Yields the message list whenever the model has to be called and receives
+    the raw reply text back; returns the final result dict.
+    """
     # === Strategy Tracking State ===
     attempted_fields = set()
     successful_summaries = 0
     round_count = 0
-    available_fields = set(list_possible_fields(parsed_data).get("available_fields", []))
+    available_fields = set(parsed_data.available_fields())
 
     for round_num in range(1, MAX_ROUNDS + 1):
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=0.2,
-            max_tokens=800,
-            response_format={"type": "json_object"}
-        )
-
-        content = json.loads(response.choices[0].message.content)
+        content = json.loads((yield messages))
 
         # Pretty print the content from this round
         pretty_print_stage3_content(content, round_num)
@@ -531,7 +773,7 @@ Available tools:
         # Log assistant response to message list
         messages.append({
             "role": "assistant",
-            "content": json.dumps(content, indent=2)
+            "content": json.dumps(content, separators=COMPACT)
         })
 
         # === CLARIFICATION ===
@@ -563,7 +805,7 @@ Available tools:
                     "role": "user",
                     "content": json.dumps({
                         "tool_results": strategy_result["result"]
-                    }, indent=2)
+                    }, separators=COMPACT)
                 })
 
             elif strategy_result["status"] == "done_collecting":
@@ -573,7 +815,7 @@ Available tools:
                     "content": json.dumps({
                         "tool_results": strategy_result["result"],
                         "note": "Please provide your final answer based on these summaries."
-                    }, indent=2)
+                    }, separators=COMPACT)
                 })
 
             elif strategy_result["status"] == "stopped":
@@ -582,7 +824,7 @@ Available tools:
                     "role": "user",
                     "content": json.dumps({
                         "reason": strategy_result["reason"]
-                    }, indent=2)
+                    }, separators=COMPACT)
                 })
                 return {
                     "status": "incomplete",
@@ -0,0 +1,67 @@
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_STORE_MAX_BYTES = int(os.getenv("DATASET_STORE_MAX_BYTES", 2 * 1024 ** 3))
+
+
+class DatasetStore:
+    """
+    In-process datasets keyed by dataset ID, bounded by a memory budget.
+
+    Each dataset is accounted by ``LogDataset.memory_nbytes`` (memory-mapped
+    columns are backed by the page cache and not counted), measured again on
+    every store and lookup since its ``derived_cache`` grows as it is queried.
+    When the total exceeds ``max_bytes`` the least recently used datasets are
+    dropped; a later request for an evicted ID reattaches it from the on-disk cache.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_STORE_MAX_BYTES, cache=None):
+        self.max_bytes = max_bytes
+        self.cache = cache
+        self.datasets = OrderedDict()
+        self.latest_id = None
+        self.lock = threading.Lock()
+
+    def put(self, dataset_id, dataset):
+        # The ID is the hash of the uploaded content, so it also keys results derived from it
+        dataset.content_fingerprint = dataset_id
+        with self.lock:
+            self.datasets[dataset_id] = dataset
+            self.datasets.move_to_end(dataset_id)
+            self.latest_id = dataset_id
+            self._evict(keep=dataset_id)
+
+    def get(self, dataset_id):
+        """Return the dataset for ``dataset_id``, reattaching it from the cache if needed, or None."""
+        with self.lock:
+            dataset = self.datasets.get(dataset_id)
+            if dataset is not None:
+                self.datasets.move_to_end(dataset_id)
+                self._evict(keep=dataset_id)  # derived results built since the last lookup count now
+                return dataset
+
+        dataset = self.cache.get(dataset_id) if self.cache else None
+        if dataset is not None:
+            dataset.content_fingerprint = dataset_id
+            with self.lock:
+                self.datasets[dataset_id] = dataset
+                self._evict(keep=dataset_id)
+        return dataset
+
+    @property
+    def total_bytes(self):
+        with self.lock:
+            return sum(dataset.memory_nbytes for dataset in self.datasets.values())
+
+    def _evict(self, keep=None):
+        sizes = {dataset_id: dataset.memory_nbytes for dataset_id, dataset in self.datasets.items()}
+        total = sum(sizes.values())
+        for dataset_id, nbytes in sizes.items():
+            if total <= self.max_bytes:
+                break
+            if dataset_id == keep:
+                continue
+            del self.datasets[dataset_id]
+            total -= nbytes
+            print(f"Evicted dataset {dataset_id} from memory ({nbytes / 1e6:.1f} MB)")
@@ -0,0 +1,75 @@
+"""
+Deterministic OpenAI-compatible chat completions server for offline load tests.
+
+Answers ``POST /v1/chat/completions`` with the stub backend's replies (see
+``llm.py``) after a fixed latency. The real OpenAI backend can be pointed at
+it, so HTTP and connection-pool behaviour is exercised without the network:
+
+    python stub_server.py --port 8089 --latency-ms 300
+    OPENAI_BASE_URL=http://localhost:8089/v1 OPENAI_API_KEY=stub uvicorn asgi:app
+"""
+import argparse
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The stages register their stub replies on import; the server itself never calls a model
+os.environ["LLM_BACKEND"] = "stub"
+import llm  # noqa: E402
+import stage1  # noqa: E402,F401
+import stage3  # noqa: E402,F401
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so clients can pool connections
+    backend = llm.StubBackend()
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            return self.send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model = request.get("model", "")
+        content = self.backend.complete(model, request.get("messages", []))
+        self.send_json({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        })
+
+    def send_json(self, body, status=200):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass  # one line per request would dominate a load test's output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=llm.LLM_STUB_LATENCY_MS,
+                        help="Delay before every reply")
+    args = parser.parse_args()
+
+    StubHandler.backend = llm.StubBackend(latency_s=args.latency_ms / 1e3)
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    print(f"Stub LLM server on http://{args.host}:{args.port}/v1 ({args.latency_ms:g} ms per reply)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_TOOL_CACHE_MAX_BYTES = int(os.getenv("TOOL_CACHE_MAX_BYTES", 64 * 1024 ** 2))
+
+# Argument lists whose order does not change a tool's answer
+UNORDERED_ARGS = {"message_types"}
+
+
+def canonical_args(args):
+    """Stable encoding of tool arguments: sorted keys, compact separators, unordered lists sorted."""
+    normalized = {
+        key: sorted(value, key=str) if key in UNORDERED_ARGS and isinstance(value, list) else value
+        for key, value in (args or {}).items()
+    }
+    return json.dumps(normalized, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class ToolResultCache:
+    """
+    Memoized Stage 3 tool results keyed by (dataset fingerprint, tool, canonical args).
+
+    Results are stored as their compact JSON encoding, which is what is
+    accounted against ``max_bytes`` and guarantees every hit returns a fresh
+    copy. The least recently used results are evicted first. Results that
+    report an error or a timeout are not stored.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_TOOL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(dataset, tool, args):
+        return dataset.fingerprint(), tool, canonical_args(args)
+
+    def get(self, key):
+        """Return a copy of the cached result for ``key``, or None."""
+        with self.lock:
+            encoded = self.entries.get(key)
+            if encoded is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return json.loads(encoded)
+
+    def put(self, key, result):
+        if not isinstance(result, dict) or "error" in result or result.get("timed_out"):
+            return
+        encoded = json.dumps(result, separators=(",", ":"))
+        if len(encoded) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous)
+            self.entries[key] = encoded
+            self.total_bytes += len(encoded)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }